@@ -0,0 +1,127 @@
+import threading
+import time
+import weakref
+from collections import Counter
+from concurrent.futures import Future
+from queue import Queue, Empty
+from typing import Any, Callable, Dict, List
+
+import forkSafe
+from metrics import BATCH_SIZE, QUEUE_WAIT_SECONDS
+
+# Queued by the finalizer of a garbage-collected batcher to stop its worker thread
+_STOP = object()
+
+
+class MicroBatcher:
+    def __init__(self, batch_fn: Callable[[List[Any]], List[Any]], max_batch_size: int = 8, max_wait_ms: float = 10.0,
+                 name: str = "batcher"):
+        """
+        Collects items submitted from concurrent callers and runs them through
+        `batch_fn` together.
+
+        A batch is dispatched as soon as `max_batch_size` items are pending, or
+        `max_wait_ms` after the first item of the batch arrived, whichever comes first.
+
+        Args:
+            batch_fn (callable): Takes a list of items and returns a list of results
+                                 in the same order.
+            max_batch_size (int): Maximum number of items per batch.
+            max_wait_ms (float): Maximum time the first item of a batch waits for others.
+            name (str): Queue label of the batcher's metrics.
+        """
+        self.batch_fn = batch_fn
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000.0
+        self.name = name
+
+        self._start()
+        # Forked serving workers start their own worker thread
+        forkSafe.register(self, MicroBatcher._start)
+
+    def _start(self):
+        self._queue = Queue()
+        self._lock = threading.Lock()
+        self._batch_sizes = Counter()
+        self._items = 0
+        self._wait_total = 0.0
+        self._wait_max = 0.0
+
+        # The thread only holds a weak reference, so it does not keep the batcher (and the
+        # model behind batch_fn) alive; it exits once the batcher is garbage collected
+        self._worker = threading.Thread(target=_work, args=(weakref.ref(self), self._queue), name="micro-batcher",
+                                        daemon=True)
+        self._worker.start()
+        weakref.finalize(self, self._queue.put, _STOP)
+
+    def submit(self, item: Any) -> Future:
+        """Queues an item and returns a future resolving to its result."""
+        future = Future()
+        self._queue.put((item, future, time.perf_counter()))
+        return future
+
+    def __call__(self, item: Any) -> Any:
+        """Submits an item and blocks until its result is available."""
+        return self.submit(item).result()
+
+    def stats(self) -> Dict[str, Any]:
+        """Returns batch-size and queue-wait statistics collected so far."""
+        with self._lock:
+            batches = sum(self._batch_sizes.values())
+            return {
+                "batches": batches,
+                "items": self._items,
+                "mean_batch_size": self._items / batches if batches else 0.0,
+                "batch_size_histogram": dict(sorted(self._batch_sizes.items())),
+                "mean_queue_wait_ms": 1000.0 * self._wait_total / self._items if self._items else 0.0,
+                "max_queue_wait_ms": 1000.0 * self._wait_max,
+                "pending": self._queue.qsize(),
+            }
+
+    def _collect(self, first: tuple) -> List[tuple]:
+        batch = [first]
+        deadline = time.perf_counter() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except Empty:
+                break
+        return batch
+
+    def _run_batch(self, first: tuple):
+        batch = self._collect(first)
+        started = time.perf_counter()
+
+        with self._lock:
+            self._batch_sizes[len(batch)] += 1
+            self._items += len(batch)
+            for _, _, enqueued in batch:
+                wait = started - enqueued
+                self._wait_total += wait
+                self._wait_max = max(self._wait_max, wait)
+                QUEUE_WAIT_SECONDS.labels(queue=self.name).observe(wait)
+        BATCH_SIZE.labels(queue=self.name).observe(len(batch))
+
+        try:
+            results = self.batch_fn([item for item, _, _ in batch])
+        except Exception as e:
+            for _, future, _ in batch:
+                future.set_exception(e)
+            return
+
+        for (_, future, _), result in zip(batch, results):
+            future.set_result(result)
+
+
+def _work(ref: "weakref.ref[MicroBatcher]", queue: Queue):
+    """Body of a batcher's worker thread."""
+    while True:
+        first = queue.get()
+        batcher = ref() if first is not _STOP else None
+        if batcher is None:
+            return
+        batcher._run_batch(first)
+        del batcher
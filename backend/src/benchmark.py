@@ -0,0 +1,323 @@
+# End-to-end and per-stage benchmark of /get-prediction.
+#
+# Starts the FastAPI app in-process with either lightweight stub models (no weights needed)
+# or the real models (loaded from the local Hugging Face / torchxrayvision caches), sends
+# synthetic chest X-ray sized images at each concurrency level and writes throughput,
+# p50/p95/p99 latencies, end to end and per stage, and cache hits to a JSON file:
+#   python benchmark.py --models stub --concurrency 1 4 8 --requests 64 --out bench.json
+#
+# With --url, an already running server is benchmarked instead.
+#
+# Every request sends images no earlier request sent, so the numbers measure inference rather
+# than the inference cache; --repeat-images cycles through the same images instead.
+
+import argparse
+import io
+import json
+import os
+import platform
+import socket
+import struct
+import subprocess
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional
+
+# Real models are only benchmarked with weights that are already downloaded
+os.environ.setdefault("HF_HUB_OFFLINE", "1")
+
+import numpy as np
+import requests
+from PIL import Image
+from requests.adapters import HTTPAdapter
+
+from batcher import MicroBatcher
+from pathology import DEFAULT_THRESHOLD, LABELS, PathologyScores, threshold_array
+from summarizer import TIER_ABSTRACTIVE, TIER_EMPTY
+
+PERCENTILES = (50, 95, 99)
+
+
+def synthetic_xray(rng: np.random.Generator, size: int = 2048, quality: int = 90) -> bytes:
+    """
+    Returns a JPEG of a grayscale, chest X-ray sized image: a smooth radial body shadow
+    plus noise, so it compresses like a radiograph rather than like flat or random pixels.
+    """
+    y, x = np.mgrid[-1:1:complex(0, size), -1:1:complex(0, size)]
+    body = np.clip(1.2 - (x ** 2 / 0.6 + y ** 2 / 0.9), 0, 1)
+    pixels = 40 + 160 * body + rng.normal(0, 12, (size, size))
+    buffer = io.BytesIO()
+    Image.fromarray(np.clip(pixels, 0, 255).astype(np.uint8), mode="L").save(buffer, format="JPEG", quality=quality)
+    return buffer.getvalue()
+
+
+def unique_variant(jpeg: bytes, tag: str) -> bytes:
+    """
+    Returns the JPEG with a comment segment holding `tag` after its start marker. The pixels
+    are unchanged but the bytes, and with them every content-keyed cache entry, differ.
+    """
+    comment = tag.encode("utf-8")
+    return jpeg[:2] + b"\xff\xfe" + struct.pack(">H", len(comment) + 2) + comment + jpeg[2:]
+
+
+class StubCheXpert:
+    def __init__(self, seconds_per_batch: float = 0.02, seconds_per_image: float = 0.01, seed: int = 0):
+        """CheXpert stand-in with a fixed cost per batch and per image, and random scores."""
+        self.seconds_per_batch = seconds_per_batch
+        self.seconds_per_image = seconds_per_image
+        self.rng = np.random.default_rng(seed)
+        # Generators are not thread-safe, and images are analyzed from several threads
+        self.rng_lock = threading.Lock()
+        self.labels = LABELS
+        self.thresholds = threshold_array(DEFAULT_THRESHOLD, LABELS)
+
+    def warmup(self):
+        pass
+
+    def analyze_images(self, images):
+        if images:
+            time.sleep(self.seconds_per_batch + self.seconds_per_image * len(images))
+        with self.rng_lock:
+            scores = self.rng.random((len(images), len(self.labels)))
+        scores[[image is None for image in images]] = np.nan
+        return PathologyScores(scores, self.labels)
+
+
+class StubReportGenerator:
+    def __init__(self, seconds_per_batch: float = 0.2, seconds_per_item: float = 0.05, max_batch_size: int = 8,
+                 max_wait_ms: float = 10.0, tokens: int = 40):
+        """
+        BLIP stand-in. Reports go through a real MicroBatcher, and each batch costs a fixed
+        time plus a time per item, like batched generation.
+        """
+        self.seconds_per_batch = seconds_per_batch
+        self.seconds_per_item = seconds_per_item
+        self.tokens = tokens
+        self.batcher = MicroBatcher(self.generate_batch, max_batch_size=max_batch_size, max_wait_ms=max_wait_ms, name="blip")
+
+    def warmup(self):
+        pass
+
+    REPORT = ("the lungs are clear. no pleural effusion", "no acute cardiopulmonary process")
+
+    def generate_batch(self, items):
+        time.sleep(self.seconds_per_batch + self.seconds_per_item * len(items))
+        return [self.REPORT for _ in items]
+
+    def generate_report(self, image_path, indication, image_type="unknown", on_text=None):
+        if on_text is None:
+            return self.batcher((image_path, indication, None))
+        for _ in range(self.tokens):
+            time.sleep((self.seconds_per_batch + self.seconds_per_item) / self.tokens)
+            on_text("word ")
+        return self.REPORT
+
+
+class StubSummarizer:
+    def __init__(self, seconds_per_batch: float = 0.1, seconds_per_item: float = 0.03):
+        """Summarizer stand-in with a fixed cost per batch and per text."""
+        self.seconds_per_batch = seconds_per_batch
+        self.seconds_per_item = seconds_per_item
+
+    def warmup(self):
+        pass
+
+    def summarize_tiered(self, jobs):
+        texts = [text for text, _, _ in jobs if text]
+        if texts:
+            time.sleep(self.seconds_per_batch + self.seconds_per_item * len(texts))
+        return [(" ".join(text.split()[:max_length]), TIER_ABSTRACTIVE) if text else ("", TIER_EMPTY)
+                for text, _, max_length in jobs]
+
+    def summarize_stream(self, text, min_length=0, max_length=80, on_text=None):
+        summary, tier = self.summarize_tiered([(text, min_length, max_length)])[0]
+        if on_text is not None and summary:
+            on_text(summary)
+        return summary, tier
+
+
+def stub_study_search(query_text: str, max_results: int = 5, seconds: float = 0.05) -> List[Dict[str, str]]:
+    time.sleep(seconds)
+    return [{"title": f"Study {i}", "authors": [], "abstract": query_text[:200], "link": ""} for i in range(max_results)]
+
+
+def start_app(models: str):
+    """
+    Serves the FastAPI app on a free local port from a background thread.
+
+    Returns:
+        str: Base URL of the server.
+    """
+    # The registry below is filled before any model is requested
+    os.environ["MODEL_LOADING"] = "lazy"
+    import uvicorn
+    import main
+    from modelRegistry import ModelRegistry
+
+    if models == "stub":
+        registry = ModelRegistry()
+        registry.register("report_generator", StubReportGenerator, StubReportGenerator.warmup)
+        registry.register("chexpert", StubCheXpert, StubCheXpert.warmup)
+        registry.register("summarizer", StubSummarizer, StubSummarizer.warmup)
+        main.registry = registry
+        main.study_search = stub_study_search
+    main.registry.start(wait=True)
+
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.bind(("127.0.0.1", 0))
+    server = uvicorn.Server(uvicorn.Config(main.app, log_level="warning"))
+    threading.Thread(target=server.run, kwargs={"sockets": [sock]}, daemon=True).start()
+    while not server.started:
+        time.sleep(0.05)
+    return f"http://127.0.0.1:{sock.getsockname()[1]}"
+
+
+def send_request(session: requests.Session, url: str, uid: str, frontal: bytes, lateral: bytes, max_studies: int):
+    started = time.perf_counter()
+    response = session.post(
+        f"{url}/get-prediction",
+        files={
+            "uid": (None, uid),
+            "frontalImage": ("frontal.jpg", frontal, "image/jpeg"),
+            "lateralImage": ("lateral.jpg", lateral, "image/jpeg"),
+            "indications": (None, "cough and fever"),
+            "maxStudies": (None, str(max_studies)),
+            "timings": (None, "true"),
+        },
+        timeout=600
+    )
+    latency = time.perf_counter() - started
+    if response.status_code != 200:
+        return latency, response.status_code, None
+    return latency, 200, response.json()[0].get("timings", {})
+
+
+def summarize_latencies(latencies: List[float]) -> Optional[Dict[str, float]]:
+    if not latencies:
+        return None
+    values = np.array(latencies) * 1000.0
+    summary = {f"p{p}_ms": round(float(np.percentile(values, p)), 2) for p in PERCENTILES}
+    summary["mean_ms"] = round(float(values.mean()), 2)
+    return summary
+
+
+def fetch_stats(session: requests.Session, url: str) -> Optional[Dict[str, Any]]:
+    """Returns the server's /stats, or None if it cannot be read."""
+    try:
+        response = session.get(f"{url}/stats", timeout=10)
+        response.raise_for_status()
+        return response.json()
+    except (requests.RequestException, ValueError):
+        return None
+
+
+def cache_activity(before: Optional[Dict[str, Any]], after: Optional[Dict[str, Any]]) -> Optional[Dict[str, int]]:
+    """Returns the inference cache lookups and coalesced requests between two /stats snapshots."""
+    if not before or not after:
+        return None
+    activity = {
+        key: after["inference_cache"][key] - before["inference_cache"][key]
+        for key in ("hits", "memory_hits", "disk_hits", "misses")
+    }
+    activity["coalesced_requests"] = after["coalescing"]["followers"] - before["coalescing"]["followers"]
+    return activity
+
+
+def run_level(url: str, images: List[bytes], concurrency: int, n_requests: int, max_studies: int,
+              repeat_images: bool = False) -> Dict[str, Any]:
+    """
+    Sends `n_requests` requests with `concurrency` requests in flight at any time.
+
+    Unless `repeat_images` is set, each request's images are made unique, so no request is
+    answered from the inference cache or coalesced with another.
+    """
+    session = requests.Session()
+    session.mount("http://", HTTPAdapter(pool_maxsize=concurrency))
+
+    def one(i):
+        uid = f"bench-{concurrency}-{i}-{time.time_ns()}"
+        frontal, lateral = images[(2 * i) % len(images)], images[(2 * i + 1) % len(images)]
+        if not repeat_images:
+            frontal, lateral = unique_variant(frontal, f"{uid}-frontal"), unique_variant(lateral, f"{uid}-lateral")
+        return send_request(session, url, uid, frontal, lateral, max_studies)
+
+    stats_before = fetch_stats(session, url)
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        outcomes = list(pool.map(one, range(n_requests)))
+    elapsed = time.perf_counter() - started
+    stats_after = fetch_stats(session, url)
+
+    ok = [(latency, timings) for latency, status, timings in outcomes if status == 200]
+    stages = {}
+    for _, timings in ok:
+        for stage, seconds in timings.items():
+            stages.setdefault(stage, []).append(seconds)
+
+    return {
+        "concurrency": concurrency,
+        "requests": n_requests,
+        "succeeded": len(ok),
+        "rejected": sum(status == 503 for _, status, _ in outcomes),
+        "errors": sum(status not in (200, 503) for _, status, _ in outcomes),
+        "seconds": round(elapsed, 3),
+        "throughput_rps": round(len(ok) / elapsed, 3),
+        "end_to_end": summarize_latencies([latency for latency, _ in ok]),
+        "stages": {stage: summarize_latencies(values) for stage, values in sorted(stages.items())},
+        "cache": cache_activity(stats_before, stats_after),
+    }
+
+
+def environment() -> Dict[str, Any]:
+    """Records what the numbers depend on, so runs can be compared."""
+    try:
+        commit = subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {"commit": commit, "python": platform.python_version(), "machine": platform.machine(), "cpus": os.cpu_count()}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark /get-prediction end to end and per stage.")
+    parser.add_argument("--models", choices=("stub", "real"), default="stub", help="Models served by the in-process app.")
+    parser.add_argument("--url", default=None, help="Benchmark a running server instead of an in-process app.")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 4, 8], help="Concurrency levels.")
+    parser.add_argument("--requests", type=int, default=32, help="Requests per concurrency level.")
+    parser.add_argument("--warmup-requests", type=int, default=2, help="Requests sent before measuring.")
+    parser.add_argument("--distinct-images", type=int, default=16, help="Synthetic images to cycle through.")
+    parser.add_argument("--repeat-images", action="store_true",
+                        help="Send the images unchanged, so repeats hit the inference cache, instead of "
+                             "making every request's images unique.")
+    parser.add_argument("--image-size", type=int, default=2048, help="Side of the synthetic images in pixels.")
+    parser.add_argument("--max-studies", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--out", default="benchmark.json", help="JSON result file.")
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(args.seed)
+    images = [synthetic_xray(rng, args.image_size) for _ in range(max(2, args.distinct_images))]
+
+    url = args.url or start_app(args.models)
+    if args.warmup_requests:
+        run_level(url, images, 1, args.warmup_requests, args.max_studies, args.repeat_images)
+
+    levels = []
+    for concurrency in args.concurrency:
+        level = run_level(url, images, concurrency, args.requests, args.max_studies, args.repeat_images)
+        levels.append(level)
+        print(f"concurrency {concurrency}: {level['throughput_rps']} req/s, end to end {level['end_to_end']}, "
+              f"cache {level['cache']}")
+
+    report = {
+        "environment": environment(),
+        "settings": {k: v for k, v in vars(args).items() if k != "out"},
+        "levels": levels,
+    }
+    with open(args.out, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"Results written to {args.out}")
+
+
+if __name__ == "__main__":
+    main()
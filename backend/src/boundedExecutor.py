@@ -0,0 +1,60 @@
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable, Optional
+
+from metrics import QUEUE_WAIT_SECONDS
+
+
+class BoundedExecutor:
+    def __init__(self, max_workers: int, max_queue: int = 0, thread_name_prefix: str = "inference"):
+        """
+        A thread pool that refuses work instead of queueing it without bound.
+
+        Args:
+            max_workers (int): Number of jobs that run at the same time.
+            max_queue (int): Number of jobs allowed to wait for a free worker.
+            thread_name_prefix (str): Prefix of the worker thread names, and queue label of
+                                      the wait time metric.
+        """
+        self.max_workers = max_workers
+        self.max_queue = max_queue
+        self.name = thread_name_prefix
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=thread_name_prefix)
+        self._slots = threading.BoundedSemaphore(max_workers + max_queue)
+        self._lock = threading.Lock()
+        self._in_flight = 0
+
+    def try_submit(self, fn: Callable, *args, **kwargs) -> Optional[Future]:
+        """
+        Schedules `fn(*args, **kwargs)` if there is room for it.
+
+        Returns:
+            Future: The future of the job, or None if all workers and queue slots are taken.
+        """
+        if not self._slots.acquire(blocking=False):
+            return None
+
+        with self._lock:
+            self._in_flight += 1
+
+        future = self._executor.submit(self._run, time.perf_counter(), fn, args, kwargs)
+        future.add_done_callback(self._release)
+        return future
+
+    def _run(self, submitted: float, fn: Callable, args, kwargs):
+        QUEUE_WAIT_SECONDS.labels(queue=self.name).observe(time.perf_counter() - submitted)
+        return fn(*args, **kwargs)
+
+    def _release(self, _future: Future):
+        with self._lock:
+            self._in_flight -= 1
+        self._slots.release()
+
+    @property
+    def in_flight(self) -> int:
+        """Number of jobs currently running or waiting."""
+        return self._in_flight
+
+    def shutdown(self, wait: bool = True):
+        self._executor.shutdown(wait=wait)
@@ -0,0 +1,190 @@
+# Offline bulk inference over a manifest of studies, with checkpoint/resume.
+#
+# The manifest is JSONL, one study per line in the `data` format of getPrediction:
+#   {"uid": "s1", "frontal_images": ["s1/f.jpg"], "lateral_images": ["s1/l.jpg"], "indications": "cough"}
+# or CSV with uid, frontal_images, lateral_images and indications columns, multiple images
+# separated by ";". Relative image paths are resolved against the manifest's directory.
+#
+# Results are appended to the output JSONL as each chunk of studies finishes. Rerunning the
+# same command skips the studies already in the output:
+#   python bulk.py manifest.jsonl --out results.jsonl --max-studies 5
+
+import argparse
+import csv
+import json
+import logging
+import os
+import threading
+import time
+from queue import Queue
+from typing import Any, Dict, Iterable, Iterator, List, Set
+
+import config
+from cache import InferenceCache
+from imageLoader import load_images
+from logs import configure_logging
+from models import create_registry, get_study_search
+from predict import getPrediction
+
+IMAGE_FIELDS = ("frontal_images", "lateral_images")
+
+logger = logging.getLogger("bulk")
+
+
+def read_manifest(path: str) -> Iterator[Dict[str, Any]]:
+    """
+    Reads the studies of a JSONL or CSV manifest.
+
+    Returns:
+        iterator: Studies in the `data` format of getPrediction, with absolute image paths.
+    """
+    base_dir = os.path.dirname(os.path.abspath(path))
+
+    with open(path, newline="") as f:
+        if path.lower().endswith(".csv"):
+            rows = (
+                {**row, **{field: [p for p in (row.get(field) or "").split(";") if p.strip()] for field in IMAGE_FIELDS}}
+                for row in csv.DictReader(f)
+            )
+        else:
+            rows = (json.loads(line) for line in f if line.strip())
+
+        for row in rows:
+            yield {
+                "uid": str(row["uid"]),
+                **{field: [os.path.join(base_dir, p.strip()) for p in row.get(field) or []] for field in IMAGE_FIELDS},
+                "indications": row.get("indications") or "",
+            }
+
+
+def completed_uids(path: str) -> Set[str]:
+    """
+    Returns the uids already written to an output file.
+
+    A line cut short by a crash is truncated away, so new results are appended after the
+    last complete one.
+    """
+    uids = set()
+    if not os.path.exists(path):
+        return uids
+
+    valid_end = 0
+    with open(path, "rb") as f:
+        for line in f:
+            try:
+                uids.add(json.loads(line)["uid"])
+            except (ValueError, KeyError, TypeError):
+                break
+            valid_end += len(line)
+
+    with open(path, "r+b") as f:
+        if valid_end < os.path.getsize(path):
+            logger.warning("Truncating incomplete output after byte %d of %s", valid_end, path)
+            f.truncate(valid_end)
+        # The last complete line may still lack its newline
+        if valid_end:
+            f.seek(valid_end - 1)
+            if f.read(1) != b"\n":
+                f.write(b"\n")
+
+    return uids
+
+
+def chunked(studies: Iterable[Dict[str, Any]], chunk_size: int) -> Iterator[List[Dict[str, Any]]]:
+    chunk = []
+    for study in studies:
+        chunk.append(study)
+        if len(chunk) == chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def prefetch(chunks: Iterable[List[Dict[str, Any]]], depth: int) -> Iterator[List[Dict[str, Any]]]:
+    """
+    Decodes the images of upcoming chunks on a background thread while the models run.
+
+    At most `depth` decoded chunks are held in memory. Images that fail to decode are
+    passed on as None, and getPrediction skips them.
+    """
+    queue = Queue(maxsize=depth)
+    done = object()
+
+    def produce():
+        try:
+            for chunk in chunks:
+                for study in chunk:
+                    for field in IMAGE_FIELDS:
+                        study[field] = load_images(study[field])
+                queue.put(chunk)
+        except Exception as e:
+            queue.put(e)
+        queue.put(done)
+
+    threading.Thread(target=produce, name="bulk-prefetch", daemon=True).start()
+
+    for item in iter(queue.get, done):
+        if isinstance(item, Exception):
+            raise item
+        yield item
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the models over a manifest of studies and write the results to JSONL.")
+    parser.add_argument("manifest", help="JSONL or CSV manifest of studies.")
+    parser.add_argument("--out", required=True, help="Output JSONL file. Studies already in it are skipped.")
+    parser.add_argument("--chunk-size", type=int, default=config.JOB_CHUNK_SIZE,
+                        help="Studies per getPrediction call; the models batch across them.")
+    parser.add_argument("--prefetch", type=int, default=2, help="Decoded chunks held ahead of the models.")
+    parser.add_argument("--max-studies", type=int, default=None, help="Related studies to fetch per study (default: none).")
+    args = parser.parse_args()
+    configure_logging()
+
+    done_uids = completed_uids(args.out)
+    if done_uids:
+        logger.info("Resuming: %d studies already in %s", len(done_uids), args.out)
+
+    def pending():
+        for study in read_manifest(args.manifest):
+            if study["uid"] not in done_uids:
+                done_uids.add(study["uid"])
+                yield study
+
+    registry = create_registry(InferenceCache(config.INFERENCE_CACHE_MAX_BYTES, config.INFERENCE_CACHE_PATH or None))
+    registry.start(wait=True)
+    study_search = get_study_search(registry)
+
+    written = failed = 0
+    started = time.perf_counter()
+    with open(args.out, "a") as out:
+        for chunk in prefetch(chunked(pending(), args.chunk_size), args.prefetch):
+            try:
+                results = getPrediction(
+                    data=chunk,
+                    report_generator=registry.get("report_generator"),
+                    chexpert=registry.get("chexpert"),
+                    summarizer=registry.get("summarizer"),
+                    max_studies=args.max_studies,
+                    study_search=study_search
+                )
+            except Exception as e:
+                # Failed studies are not written, so the next run retries them
+                failed += len(chunk)
+                logger.exception("Failed studies %s: %s", [study["uid"] for study in chunk], e)
+                continue
+
+            for result in results:
+                out.write(json.dumps(result) + "\n")
+            out.flush()
+            os.fsync(out.fileno())
+
+            written += len(results)
+            elapsed = time.perf_counter() - started
+            logger.info("%d studies written (%.2f/s), %d failed", written, written / elapsed, failed)
+
+    logger.info("Done: %d studies written to %s, %d failed", written, args.out, failed)
+
+
+if __name__ == "__main__":
+    main()
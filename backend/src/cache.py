@@ -0,0 +1,186 @@
+import hashlib
+import os
+import pickle
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional
+
+import forkSafe
+from metrics import CACHE_LOOKUPS
+
+# Result label of the lookup metric for each InferenceCache counter
+_LOOKUP_RESULTS = {"memory_hits": "memory_hit", "disk_hits": "disk_hit", "misses": "miss"}
+
+
+def make_key(*parts) -> str:
+    """Builds a cache key by hashing the given parts."""
+    return hashlib.sha256("\x1f".join(str(part) for part in parts).encode("utf-8")).hexdigest()
+
+
+class LRUCache:
+    def __init__(self, max_bytes: int):
+        """
+        In-memory least-recently-used cache bounded by the total size of its values.
+
+        Args:
+            max_bytes (int): Maximum total pickled size of the cached values.
+        """
+        self.max_bytes = max_bytes
+        self.nbytes = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[Any]:
+        """Returns the cached value, or None if the key is not cached."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            self._entries.move_to_end(key)
+            return entry[0]
+
+    def put(self, key: str, value: Any, size: Optional[int] = None):
+        """Caches a value, evicting the least recently used entries to stay within `max_bytes`."""
+        if size is None:
+            size = len(pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL))
+        if size > self.max_bytes:
+            return
+
+        with self._lock:
+            if key in self._entries:
+                self.nbytes -= self._entries.pop(key)[1]
+            self._entries[key] = (value, size)
+            self.nbytes += size
+            while self.nbytes > self.max_bytes:
+                _, (_, evicted_size) = self._entries.popitem(last=False)
+                self.nbytes -= evicted_size
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+class DiskCache:
+    def __init__(self, path: str, ttl: Optional[float] = None, purge_every: int = 1000):
+        """
+        Persistent cache of pickled values stored in a SQLite database.
+
+        With a TTL, expired entries are deleted when the cache is opened and then every
+        `purge_every` puts, so the file does not grow without bound.
+
+        Args:
+            path (str): Path of the database file. Parent directories are created.
+            ttl (float): Seconds after which entries expire, or None to keep them forever.
+            purge_every (int): Number of puts between purges of expired entries.
+        """
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.path = path
+        self.ttl = ttl
+        self.purge_every = max(1, purge_every)
+        self._puts = 0
+        self._connect()
+        # SQLite connections must not be shared across a fork, so forked workers reconnect
+        forkSafe.register(self, DiskCache._connect)
+        self._conn.execute("CREATE TABLE IF NOT EXISTS cache (key TEXT PRIMARY KEY, value BLOB, created REAL)")
+        columns = [row[1] for row in self._conn.execute("PRAGMA table_info(cache)")]
+        if "created" not in columns:
+            self._conn.execute("ALTER TABLE cache ADD COLUMN created REAL")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS cache_created ON cache (created)")
+        self._conn.commit()
+        self.purge_expired()
+
+    def _connect(self):
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.path, check_same_thread=False)
+
+    def get(self, key: str) -> Optional[Any]:
+        """Returns the cached value, or None if the key is not cached or has expired."""
+        with self._lock:
+            row = self._conn.execute("SELECT value, created FROM cache WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return None
+        if self.ttl is not None and (row[1] is None or time.time() - row[1] > self.ttl):
+            return None
+        return pickle.loads(row[0])
+
+    def put(self, key: str, value: Any):
+        """Stores a value, replacing any previous value of the key."""
+        blob = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+        with self._lock:
+            self._conn.execute("INSERT OR REPLACE INTO cache (key, value, created) VALUES (?, ?, ?)", (key, blob, time.time()))
+            self._conn.commit()
+            self._puts += 1
+            purge = self._puts % self.purge_every == 0
+        if purge:
+            self.purge_expired()
+
+    def purge_expired(self) -> int:
+        """Deletes expired entries and returns how many were removed."""
+        if self.ttl is None:
+            return 0
+        with self._lock:
+            cursor = self._conn.execute("DELETE FROM cache WHERE created IS NULL OR created < ?", (time.time() - self.ttl,))
+            self._conn.commit()
+        return cursor.rowcount
+
+
+class InferenceCache:
+    def __init__(self, max_bytes: int = 64 * 1024 * 1024, disk_path: Optional[str] = None):
+        """
+        Two-tier cache for model outputs: an in-memory LRU backed by an optional
+        on-disk tier that survives restarts.
+
+        Args:
+            max_bytes (int): Size bound of the in-memory tier.
+            disk_path (str): Path of the SQLite file of the on-disk tier, or None to
+                             keep the cache in memory only.
+        """
+        self.memory = LRUCache(max_bytes)
+        self.disk = DiskCache(disk_path) if disk_path else None
+        self._lock = threading.Lock()
+        self._counters = {"memory_hits": 0, "disk_hits": 0, "misses": 0}
+
+    def _count(self, counter: str):
+        with self._lock:
+            self._counters[counter] += 1
+        CACHE_LOOKUPS.labels(cache="inference", result=_LOOKUP_RESULTS[counter]).inc()
+
+    def get(self, key: str) -> Optional[Any]:
+        """Looks a key up in memory, then on disk. Disk hits are promoted to memory."""
+        value = self.memory.get(key)
+        if value is not None:
+            self._count("memory_hits")
+            return value
+
+        if self.disk is not None:
+            value = self.disk.get(key)
+            if value is not None:
+                self._count("disk_hits")
+                self.memory.put(key, value)
+                return value
+
+        self._count("misses")
+        return None
+
+    def put(self, key: str, value: Any):
+        """Stores a value in every tier."""
+        self.memory.put(key, value)
+        if self.disk is not None:
+            self.disk.put(key, value)
+
+    def stats(self) -> Dict[str, Any]:
+        """Returns hit/miss counters and the size of the in-memory tier."""
+        with self._lock:
+            counters = dict(self._counters)
+        hits = counters["memory_hits"] + counters["disk_hits"]
+        lookups = hits + counters["misses"]
+        return {
+            "hits": hits,
+            **counters,
+            "hit_rate": hits / lookups if lookups else 0.0,
+            "entries": len(self.memory),
+            "bytes": self.memory.nbytes,
+        }
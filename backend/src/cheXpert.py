@@ -1,6 +1,8 @@
 # prompt: create a class out of the important functions:
+import logging
 import numpy as np
 import urllib.request
+from concurrent.futures import ThreadPoolExecutor
 import skimage
 import torch
 import torch.nn.functional as F
@@ -8,30 +10,98 @@ import torchvision
 import torchvision.transforms
 import torchxrayvision as xrv
 
+import forkSafe
+from cache import make_key
+from imageLoader import DecodedImage
+from onnxBackend import OnnxModel, check_backend, onnx_path
+from pathology import DEFAULT_THRESHOLD, LABELS, PathologyScores, Thresholds, threshold_array
+from precision import apply_precision, input_dtype
+from utils import image_digest, image_source, is_image_path
+
+logger = logging.getLogger(__name__)
+
 class CheXpert:
-    def __init__(self, model_name="densenet121-res224-chex"):
+    def __init__(self, model_name="densenet121-res224-chex", resolution=224, batch_size=16, num_workers=4, cache=None, precision="fp32",
+                 backend="torch", thresholds: Thresholds = DEFAULT_THRESHOLD, default_threshold: float = DEFAULT_THRESHOLD):
         """
         Initializes the handler with a pre-trained X-ray model.
 
         Args:
             model_name (str): The name of the torchxrayvision model to load.
                               Defaults to "densenet121-res224-chex".
+            resolution (int): Input resolution of the model. Images are resized to
+                              this before being stacked into a batch.
+            batch_size (int): Maximum number of images per forward pass.
+            num_workers (int): Number of threads used to preprocess images in parallel.
+            cache (InferenceCache): Optional cache of predictions keyed by image content
+                                    and model name.
+            precision (str): "fp32", "bf16" or "int8", see `precision.apply_precision`.
+            backend (str): "torch", or "onnx" to run the exported graph with ONNX Runtime.
+            thresholds (float or dict): Score at or above which a pathology is reported as
+                                        found, for all pathologies or per pathology.
+            default_threshold (float): Threshold of the pathologies missing from a
+                                       per-pathology `thresholds` dict.
+        """
+        check_backend(backend, precision)
+        self.model_name = model_name
+        self.labels = LABELS
+        self.thresholds = threshold_array(thresholds, self.labels, default_threshold)
+        self.precision = precision
+        self.resolution = resolution
+        self.transform = torchvision.transforms.Compose([xrv.datasets.XRayCenterCrop()])
+        self.backend = backend
+        self.model, self.runner = self.load_model(model_name)
+        self.batch_size = batch_size
+        self.num_workers = num_workers
+        self.pool = ThreadPoolExecutor(max_workers=num_workers)
+        self.cache = cache
+        # Forked serving workers get their own preprocessing pool
+        forkSafe.register(self, CheXpert._reset_pool)
+
+    def _reset_pool(self):
+        self.pool = ThreadPoolExecutor(max_workers=self.num_workers)
+
+    def load_model(self, model_name):
+        """
+        Loads torchxrayvision DenseNet weights in the configured precision and backend.
+
+        Returns:
+            tuple: The torch model, and the callable that runs it (the model itself, or
+                   its ONNX Runtime session).
         """
-        self.model = xrv.models.DenseNet(weights=model_name)
-        self.model.eval()  # Set model to evaluation mode
+        model = xrv.models.DenseNet(weights=model_name)
+        model.eval()  # Set model to evaluation mode
+        model = apply_precision(model, self.precision)
+        runner = model
+        if self.backend == "onnx":
+            runner = OnnxModel(model, torch.zeros(1, 1, self.resolution, self.resolution), onnx_path(model_name))
+        return model, runner
 
     def load_and_preprocess_image(self, image_path):
         """
-        Loads an image from a given path, preprocesses it for model input.
+        Loads an image from a given path or buffer, preprocesses it for model input.
 
         Args:
-            image_path (str): The path to the image file.
+            image_path (str, bytes, np.ndarray or DecodedImage): The path to the image file,
+                                                   an encoded image buffer, or an already
+                                                   decoded image with 0-255 pixel values.
 
         Returns:
             torch.Tensor: The processed image tensor ready for inference.
         """
-        # Use skimage to read the image
-        img = skimage.io.imread(image_path)
+        if image_path is None:
+            return None
+
+        # Use skimage to read the image, unless it was already decoded
+        if isinstance(image_path, DecodedImage):
+            img = image_path.gray
+        elif isinstance(image_path, np.ndarray):
+            img = image_path
+        else:
+            img = skimage.io.imread(image_source(image_path))
+
+        if not is_image_path(image_path):
+            image_path = "<in-memory image>"
 
         # Normalize image data
         img = xrv.datasets.normalize(img, 255)
@@ -41,15 +111,14 @@ class CheXpert:
             # If it has more than 2 dimensions, assume it's color and take the first channel
             img = img[:, :, 0]
         if len(img.shape) < 2:
-            print(f"Warning: Image at {image_path} has dimension lower than 2.")
+            logger.warning("Image at %s has dimension lower than 2.", image_path)
             return None
 
         # Add color channel dimension (expected by torchxrayvision)
         img = img[None, :, :]
 
         # Apply center crop transform
-        transform = torchvision.transforms.Compose([xrv.datasets.XRayCenterCrop()])
-        img = transform(img)
+        img = self.transform(img)
 
         # Convert numpy array to torch tensor and add batch dimension
         img_tensor = torch.from_numpy(img).unsqueeze(0)
@@ -64,33 +133,102 @@ class CheXpert:
             img_tensor (torch.Tensor): The preprocessed image tensor.
 
         Returns:
-            dict: A dictionary mapping pathology names to prediction scores.
+            PathologyScores: A single row of scores, NaN if the tensor is None.
         """
         if img_tensor is None:
-            return {}
+            return PathologyScores.empty(1, self.labels)
+
+        return self.predict_batch(img_tensor)
+
+    def predict_batch(self, batch_tensor):
+        """
+        Performs inference on a batch of preprocessed image tensors.
 
+        Args:
+            batch_tensor (torch.Tensor): Tensor of shape (N, 1, H, W).
+
+        Returns:
+            PathologyScores: One row of scores per image.
+        """
         with torch.no_grad():
-            outputs = self.model(img_tensor).cpu() # Move output to CPU
+            outputs = self.runner(batch_tensor.to(input_dtype(self.precision))).float().cpu() # Move output to CPU
+
+        return PathologyScores(outputs.detach().numpy(), self.labels)
 
-        # Format the output as a dictionary
-        prediction_output = {
-            k: float(v)
-            for k, v in zip(xrv.datasets.default_pathologies, outputs[0].detach().numpy())
-        }
-        return prediction_output
+    def warmup(self):
+        """Runs a synthetic forward pass so the first request does not pay for lazy initialization."""
+        self.predict_batch(torch.zeros(1, 1, self.resolution, self.resolution))
+
+    def resize(self, img_tensor):
+        """
+        Resizes a preprocessed image tensor to the model resolution so that images of
+        different sizes can be stacked. Mirrors the interpolation the model applies itself.
+        """
+        if img_tensor.shape[-2:] != (self.resolution, self.resolution):
+            img_tensor = F.interpolate(img_tensor, size=(self.resolution, self.resolution),
+                                       mode="bilinear", align_corners=False)
+        return img_tensor
 
     def analyze_image(self, image_path):
         """
         Loads, preprocesses, and analyzes an image, returning the pathology predictions.
 
         Args:
-            image_path (str): The path to the image file.
+            image_path (str, bytes or np.ndarray): The path to the image file, an encoded
+                                                   image buffer, or a decoded image array.
 
         Returns:
-            dict: A dictionary mapping pathology names to prediction scores.
+            PathologyScores: A single row of scores.
         """
-        img_tensor = self.load_and_preprocess_image(image_path)
-        if img_tensor is None:
-            return {}
-        predictions = self.predict(img_tensor)
-        return predictions
\ No newline at end of file
+        return self.analyze_images([image_path])
+
+    def analyze_images(self, images):
+        """
+        Loads, preprocesses, and analyzes several images with batched forward passes.
+
+        Images are preprocessed in parallel and stacked into batches of at most
+        `batch_size` images. With a cache, only images not seen before reach the model.
+
+        Args:
+            images (list): Image file paths, encoded buffers, decoded image arrays or
+                           DecodedImage instances.
+
+        Returns:
+            PathologyScores: One row of scores per input, in input order. Images that
+                             could not be preprocessed get NaN scores.
+        """
+        predictions = PathologyScores.empty(len(images), self.labels)
+        if not images:
+            return predictions
+
+        keys = [None] * len(images)
+        if self.cache is not None:
+            keys = list(self.pool.map(self.cache_key, images))
+        pending = []
+        for i, key in enumerate(keys):
+            cached = self.cache.get(key) if key is not None else None
+            if cached is not None:
+                predictions.scores[i] = cached
+            else:
+                pending.append(i)
+
+        tensors = list(self.pool.map(self.load_and_preprocess_image, [images[i] for i in pending]))
+        valid = [i for i, tensor in zip(pending, tensors) if tensor is not None]
+        tensors = dict(zip(pending, tensors))
+
+        for start in range(0, len(valid), self.batch_size):
+            chunk = valid[start:start + self.batch_size]
+            batch = torch.cat([self.resize(tensors[i]) for i in chunk])
+            scores = self.predict_batch(batch).scores
+            predictions.scores[chunk] = scores
+            for i, row in zip(chunk, scores):
+                if keys[i] is not None:
+                    self.cache.put(keys[i], row.copy())
+
+        return predictions
+
+    def cache_key(self, image):
+        """Returns the cache key of an image's predictions, or None if the image is missing."""
+        digest = image_digest(image)
+        # Score rows are cached as arrays, under a prefix distinct from the dicts earlier versions cached
+        return make_key("chexpert-scores", self.model_name, self.precision, digest) if digest else None
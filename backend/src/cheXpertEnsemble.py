@@ -0,0 +1,146 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Sequence, Tuple
+
+import numpy as np
+import torch
+
+import forkSafe
+from cheXpert import CheXpert
+from metrics import ENSEMBLE_MEMBER_SECONDS
+from pathology import DEFAULT_THRESHOLD, LABELS, PathologyScores, Thresholds, threshold_array
+from precision import input_dtype
+
+
+def parse_members(spec: str) -> List[Tuple[str, float]]:
+    """
+    Parses ensemble members given as "densenet121-res224-chex,densenet121-res224-nih:0.5".
+
+    Returns:
+        list: (weights name, merge weight) of each member. The weight defaults to 1.
+    """
+    members = []
+    for item in spec.split(","):
+        item = item.strip()
+        if item:
+            name, _, weight = item.partition(":")
+            members.append((name.strip(), float(weight) if weight else 1.0))
+    return members
+
+
+class EnsembleMember:
+    def __init__(self, name: str, weight: float, model: torch.nn.Module, runner):
+        self.name = name
+        self.weight = weight
+        self.model = model
+        self.runner = runner
+        # Outputs the weights were not trained for have an empty label and are dropped when merging
+        self.labels = tuple(model.pathologies)
+
+
+class CheXpertEnsemble(CheXpert):
+    def __init__(self, members: Sequence[Tuple[str, float]], resolution=224, batch_size=16, num_workers=4, cache=None,
+                 precision="fp32", backend="torch", thresholds: Thresholds = DEFAULT_THRESHOLD,
+                 default_threshold: float = DEFAULT_THRESHOLD, concurrent=False):
+        """
+        Runs several torchxrayvision DenseNets on the same batches and merges their scores.
+
+        Images are decoded and preprocessed once; every member then runs on the same
+        batch tensor. The members must share the input resolution, as all torchxrayvision
+        DenseNets do. Scores are merged per pathology as a weighted mean over the members
+        that predict it, so members with different label sets can be combined.
+
+        Args:
+            members (sequence): (torchxrayvision weights name, merge weight) of each member.
+            concurrent (bool): Run the members on the same batch at the same time, one
+                               thread each, instead of one after the other.
+
+            The other arguments are those of `CheXpert` and apply to every member.
+        """
+        if not members:
+            raise ValueError("An ensemble needs at least one member.")
+        (first_name, first_weight), *others = members
+        super().__init__(model_name=first_name, resolution=resolution, batch_size=batch_size, num_workers=num_workers,
+                         cache=cache, precision=precision, backend=backend)
+
+        self.members = [EnsembleMember(first_name, first_weight, self.model, self.runner)]
+        for name, weight in others:
+            self.members.append(EnsembleMember(name, weight, *self.load_model(name)))
+        self.weights = np.array([member.weight for member in self.members], dtype=np.float32)
+
+        # Merged labels: the shared label order first, then any label only some member knows
+        known = {label for member in self.members for label in member.labels if label}
+        self.labels = tuple(label for label in LABELS if label in known) + tuple(sorted(known - set(LABELS)))
+        self.thresholds = threshold_array(thresholds, self.labels, default_threshold)
+
+        # Cache entries depend on every member and weight
+        self.model_name = "+".join(f"{member.name}*{member.weight:g}" for member in self.members)
+
+        self.concurrent = concurrent
+        self._latency = {member.name: {"calls": 0, "total_seconds": 0.0, "max_seconds": 0.0} for member in self.members}
+        self._reset_member_pool()
+        # Forked serving workers get their own member pool
+        forkSafe.register(self, CheXpertEnsemble._reset_member_pool)
+
+    def _reset_member_pool(self):
+        self._stats_lock = threading.Lock()
+        self.member_pool = ThreadPoolExecutor(max_workers=len(self.members), thread_name_prefix="ensemble-member")
+
+    def _run_member(self, member: EnsembleMember, batch_tensor: torch.Tensor) -> PathologyScores:
+        started = time.perf_counter()
+        with torch.no_grad():
+            outputs = member.runner(batch_tensor).float().cpu()
+        elapsed = time.perf_counter() - started
+
+        ENSEMBLE_MEMBER_SECONDS.labels(member=member.name).observe(elapsed)
+        with self._stats_lock:
+            latency = self._latency[member.name]
+            latency["calls"] += 1
+            latency["total_seconds"] += elapsed
+            latency["max_seconds"] = max(latency["max_seconds"], elapsed)
+
+        return PathologyScores(outputs.detach().numpy(), member.labels)
+
+    def predict_batch(self, batch_tensor):
+        """
+        Runs every member on a batch of preprocessed image tensors and merges their scores.
+
+        Args:
+            batch_tensor (torch.Tensor): Tensor of shape (N, 1, H, W).
+
+        Returns:
+            PathologyScores: One row of merged scores per image.
+        """
+        batch_tensor = batch_tensor.to(input_dtype(self.precision))
+        if self.concurrent and len(self.members) > 1:
+            outputs = list(self.member_pool.map(lambda member: self._run_member(member, batch_tensor), self.members))
+        else:
+            outputs = [self._run_member(member, batch_tensor) for member in self.members]
+        return self.merge(outputs)
+
+    def merge(self, member_scores: Sequence[PathologyScores]) -> PathologyScores:
+        """
+        Merges the scores of the members into the ensemble labels.
+
+        Each pathology gets the weighted mean of the members that have a (non-NaN) score
+        for it, and NaN if none has.
+        """
+        stacked = np.stack([scores.reindex(self.labels).scores for scores in member_scores])
+        valid = ~np.isnan(stacked)
+        weights = self.weights[:, None, None]
+        with np.errstate(invalid="ignore", divide="ignore"):
+            merged = (np.where(valid, stacked, 0.0) * weights).sum(axis=0) / (valid * weights).sum(axis=0)
+        return PathologyScores(merged, self.labels)
+
+    def member_stats(self) -> Dict[str, Dict[str, Any]]:
+        """Returns the number of forward passes and the mean and max latency of each member."""
+        with self._stats_lock:
+            return {
+                name: {
+                    "calls": latency["calls"],
+                    "mean_ms": 1000.0 * latency["total_seconds"] / latency["calls"] if latency["calls"] else 0.0,
+                    "max_ms": 1000.0 * latency["max_seconds"],
+                }
+                for name, latency in self._latency.items()
+            }
@@ -0,0 +1,108 @@
+# Runtime settings for the backend. Every value can be overridden with an
+# environment variable of the same name.
+
+import os
+
+# "background" loads all models in parallel at startup, "lazy" loads each on first use
+MODEL_LOADING = os.getenv("MODEL_LOADING", "background")
+
+# BLIP report generation micro-batching
+BLIP_MAX_BATCH_SIZE = int(os.getenv("BLIP_MAX_BATCH_SIZE", 8))
+BLIP_MAX_WAIT_MS = float(os.getenv("BLIP_MAX_WAIT_MS", 10))
+# Size bound of the cache of BLIP vision encoder outputs (0 disables it)
+BLIP_EMBEDDING_CACHE_MAX_BYTES = int(os.getenv("BLIP_EMBEDDING_CACHE_MAX_BYTES", 256 * 1024 * 1024))
+
+# Request admission for /get-prediction
+INFERENCE_WORKERS = int(os.getenv("INFERENCE_WORKERS", 2))
+INFERENCE_QUEUE_SIZE = int(os.getenv("INFERENCE_QUEUE_SIZE", 8))
+RETRY_AFTER_SECONDS = int(os.getenv("RETRY_AFTER_SECONDS", 10))
+
+# Stage graph execution in getPrediction
+PIPELINE_WORKERS = int(os.getenv("PIPELINE_WORKERS", 8))
+# Start the PubMed search from the indications alone, concurrently with the models
+SPECULATIVE_STUDY_SEARCH = os.getenv("SPECULATIVE_STUDY_SEARCH", "false").lower() in ("1", "true", "yes")
+
+# Image decoding shared by CheXpert and BLIP
+DECODE_WORKERS = int(os.getenv("DECODE_WORKERS", 4))
+# JPEGs are decoded at a reduced DCT scale that keeps both sides at least this large (0 decodes at full size)
+DECODE_MAX_SIDE = int(os.getenv("DECODE_MAX_SIDE", 512))
+
+# Content-addressed cache of CheXpert and BLIP outputs
+INFERENCE_CACHE_MAX_BYTES = int(os.getenv("INFERENCE_CACHE_MAX_BYTES", 64 * 1024 * 1024))
+# SQLite file of the on-disk tier; leave empty to keep the cache in memory only
+INFERENCE_CACHE_PATH = os.getenv("INFERENCE_CACHE_PATH", "")
+
+# PubMed E-utilities
+PUBMED_BASE_URL = os.getenv("PUBMED_BASE_URL", "https://eutils.ncbi.nlm.nih.gov/entrez/eutils")
+PUBMED_TIMEOUT = float(os.getenv("PUBMED_TIMEOUT", 10))
+PUBMED_RETRIES = int(os.getenv("PUBMED_RETRIES", 3))
+PUBMED_REQUESTS_PER_SECOND = float(os.getenv("PUBMED_REQUESTS_PER_SECOND", 3))
+PUBMED_POOL_SIZE = int(os.getenv("PUBMED_POOL_SIZE", 10))
+# SQLite file caching search results and articles; leave empty to disable
+PUBMED_CACHE_PATH = os.getenv("PUBMED_CACHE_PATH", "assets/cache/pubmed.sqlite")
+PUBMED_CACHE_TTL_SECONDS = float(os.getenv("PUBMED_CACHE_TTL_SECONDS", 7 * 24 * 3600))
+NCBI_API_KEY = os.getenv("NCBI_API_KEY") or None
+
+# Local study index (see studyIndex.py). When set, studies come from the index instead of PubMed
+STUDY_INDEX_DIR = os.getenv("STUDY_INDEX_DIR", "")
+STUDY_INDEX_EMBEDDING_MODEL = os.getenv("STUDY_INDEX_EMBEDDING_MODEL", "sentence-transformers/all-MiniLM-L6-v2")
+STUDY_INDEX_NPROBE = int(os.getenv("STUDY_INDEX_NPROBE", 8))
+
+# Summarizer: "sample" (original behaviour) or "greedy" for deterministic summaries
+SUMMARIZER_DECODING = os.getenv("SUMMARIZER_DECODING", "sample")
+SUMMARIZER_BATCH_SIZE = int(os.getenv("SUMMARIZER_BATCH_SIZE", 8))
+# Width, in words, of the input length buckets; only texts in the same bucket share a padded batch
+SUMMARIZER_LENGTH_BUCKET = int(os.getenv("SUMMARIZER_LENGTH_BUCKET", 64))
+# Width, in tokens, of the max_length buckets; jobs in one bucket (e.g. a study's findings and
+# impression) share a batch run with the widest limits, and summaries are trimmed to their own
+SUMMARIZER_LIMIT_BUCKET = int(os.getenv("SUMMARIZER_LIMIT_BUCKET", 32))
+# Tiered mode: short texts pass through, medium texts are summarized extractively and only
+# texts longer than SUMMARIZER_ABSTRACTIVE_BUDGET words go through the model
+SUMMARIZER_TIERED = os.getenv("SUMMARIZER_TIERED", "false").lower() in ("1", "true", "yes")
+SUMMARIZER_ABSTRACTIVE_BUDGET = int(os.getenv("SUMMARIZER_ABSTRACTIVE_BUDGET", 150))
+
+# Model precision: "fp32", "bf16" or "int8" (dynamically quantized linear layers, CPU only).
+# MODEL_PRECISION sets all three models; the per-model variables override it.
+MODEL_PRECISION = os.getenv("MODEL_PRECISION", "fp32")
+CHEXPERT_PRECISION = os.getenv("CHEXPERT_PRECISION", MODEL_PRECISION)
+BLIP_PRECISION = os.getenv("BLIP_PRECISION", MODEL_PRECISION)
+SUMMARIZER_PRECISION = os.getenv("SUMMARIZER_PRECISION", MODEL_PRECISION)
+
+# Inference backend of the DenseNet and the BLIP vision encoder: "torch" or "onnx" (fp32 only)
+CHEXPERT_BACKEND = os.getenv("CHEXPERT_BACKEND", "torch")
+BLIP_BACKEND = os.getenv("BLIP_BACKEND", "torch")
+# Exported ONNX graphs are cached here
+ONNX_CACHE_DIR = os.getenv("ONNX_CACHE_DIR", "assets/onnx")
+# ONNX Runtime intra-op threads; 0 follows torch's thread count (set per worker by serve.py)
+ONNX_INTRA_OP_THREADS = int(os.getenv("ONNX_INTRA_OP_THREADS", 0))
+
+# Batch job API (/jobs)
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", 1))
+# Studies of a job passed to getPrediction together, so the models batch across them
+JOB_CHUNK_SIZE = int(os.getenv("JOB_CHUNK_SIZE", 8))
+# Unfinished jobs accepted before new ones are refused with 503
+JOB_QUEUE_SIZE = int(os.getenv("JOB_QUEUE_SIZE", 16))
+JOB_RETENTION_SECONDS = float(os.getenv("JOB_RETENTION_SECONDS", 3600))
+# Directory image paths in job requests are resolved against; leave empty to accept base64 images only
+JOB_IMAGE_ROOT = os.getenv("JOB_IMAGE_ROOT", "")
+
+# Logging: level name, and "text" or "json" (one object per line) output
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO")
+LOG_FORMAT = os.getenv("LOG_FORMAT", "text")
+
+# Identical /get-prediction requests (same images, indications and maxStudies) that arrive
+# while the first is still running wait for and share its result
+COALESCE_REQUESTS = os.getenv("COALESCE_REQUESTS", "true").lower() in ("1", "true", "yes")
+
+# CheXpert score at or above which a pathology is mentioned in the report text, and
+# per-pathology overrides, e.g. "Effusion=0.6,Pneumonia=0.7"
+CHEXPERT_THRESHOLD = float(os.getenv("CHEXPERT_THRESHOLD", 0.8))
+CHEXPERT_THRESHOLDS = os.getenv("CHEXPERT_THRESHOLDS", "")
+
+# Ensemble of torchxrayvision DenseNets run instead of the single CheXpert model, as
+# comma-separated weights names with optional merge weights, e.g.
+# "densenet121-res224-chex,densenet121-res224-nih:0.5,densenet121-res224-mimic_ch,densenet121-res224-all".
+# Leave empty to run densenet121-res224-chex alone.
+CHEXPERT_ENSEMBLE = os.getenv("CHEXPERT_ENSEMBLE", "")
+# Run the ensemble members on each batch at the same time, one thread each
+CHEXPERT_ENSEMBLE_CONCURRENT = os.getenv("CHEXPERT_ENSEMBLE_CONCURRENT", "false").lower() in ("1", "true", "yes")
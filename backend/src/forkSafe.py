@@ -0,0 +1,44 @@
+# Re-creates per-process state in forked children.
+#
+# Threads, thread pools and connections do not survive a fork: a forked serving worker
+# inherits the objects but not the threads behind them. Objects and modules register a reset
+# function here, and one fork hook calls the reset of every live object in the child.
+# Objects are tracked weakly, so unlike os.register_at_fork with a bound method, registering
+# never keeps an object (and the model it may hold) alive.
+
+import os
+import weakref
+from typing import Any, Callable, List
+
+_objects = weakref.WeakKeyDictionary()
+_functions: List[Callable[[], Any]] = []
+
+
+def register(obj: Any, reset: Callable[[Any], Any]):
+    """
+    Calls `reset(obj)` in every forked child while `obj` is alive.
+
+    Args:
+        obj: The object whose state does not survive a fork.
+        reset (callable): Re-creates that state, e.g. `MicroBatcher._start`. Methods bound
+                          to `obj` are unbound, so the registry holds no reference to it.
+    """
+    if getattr(reset, "__self__", None) is obj:
+        reset = reset.__func__
+    _objects.setdefault(obj, []).append(reset)
+
+
+def register_function(reset: Callable[[], Any]):
+    """Calls `reset()` in every forked child, for module-level state such as shared pools."""
+    _functions.append(reset)
+
+
+def _after_fork_in_child():
+    for reset in list(_functions):
+        reset()
+    for obj, resets in list(_objects.items()):
+        for reset in resets:
+            reset(obj)
+
+
+os.register_at_fork(after_in_child=_after_fork_in_child)
@@ -0,0 +1,117 @@
+import hashlib
+import io
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Optional
+
+import numpy as np
+from PIL import Image
+
+import config
+import forkSafe
+from utils import image_digest, is_image_path
+
+logger = logging.getLogger(__name__)
+
+
+class DecodedImage:
+    def __init__(self, pixels: np.ndarray, encoded_size: int, content_hash: str):
+        """
+        An image decoded once, from which the inputs of every model are derived.
+
+        Args:
+            pixels (np.ndarray): Decoded pixels, (H, W) for grayscale or (H, W, 3) for RGB.
+            encoded_size (int): Size in bytes of the encoded image, used to pick the
+                                largest image of a view.
+            content_hash (str): Hash of the encoded image bytes.
+        """
+        self.pixels = pixels
+        self.encoded_size = encoded_size
+        # The decoded shape is part of the digest, so draft-mode decodes at different
+        # scales never share cache entries
+        self.digest = f"{content_hash}:{'x'.join(map(str, pixels.shape))}"
+
+    @classmethod
+    def load(cls, image, max_side: Optional[int] = None) -> "DecodedImage":
+        """
+        Decodes an image path, encoded buffer or pixel array.
+
+        Args:
+            image: The image to decode.
+            max_side (int): If given, JPEGs are decoded in draft mode at the smallest
+                            DCT scale that still keeps both sides at least this large.
+
+        Returns:
+            DecodedImage: The decoded image.
+        """
+        if isinstance(image, DecodedImage):
+            return image
+        if isinstance(image, np.ndarray):
+            return cls(image, image.nbytes, image_digest(image))
+
+        if is_image_path(image):
+            with open(image, "rb") as f:
+                image = f.read()
+        buffer = memoryview(image)
+
+        with Image.open(io.BytesIO(buffer)) as img:
+            if max_side and img.format == "JPEG":
+                img.draft(img.mode, (max_side, max_side))
+            if img.mode not in ("L", "RGB"):
+                img = img.convert("RGB")
+            pixels = np.asarray(img)
+
+        return cls(pixels, buffer.nbytes, hashlib.sha256(buffer).hexdigest())
+
+    @property
+    def gray(self) -> np.ndarray:
+        """Single channel view of the pixels, as consumed by CheXpert."""
+        if self.pixels.ndim > 2:
+            return self.pixels[:, :, 0]
+        return self.pixels
+
+    def rgb(self) -> Image.Image:
+        """RGB PIL image of the pixels, as consumed by the BLIP processor."""
+        return Image.fromarray(self.pixels).convert("RGB")
+
+
+_executor = None
+
+
+def _reset_executor():
+    global _executor
+    _executor = ThreadPoolExecutor(max_workers=config.DECODE_WORKERS, thread_name_prefix="decode")
+
+
+_reset_executor()
+# Forked serving workers decode on their own pool
+forkSafe.register_function(_reset_executor)
+
+
+def _load_or_none(image, max_side):
+    # Missing images, including ones that already failed to decode, stay missing quietly
+    if image is None or isinstance(image, DecodedImage):
+        return image
+    try:
+        return DecodedImage.load(image, max_side)
+    except Exception as e:
+        image_name = image if is_image_path(image) else "in-memory image"
+        logger.warning("Could not decode image %s: %s", image_name, e)
+        return None
+
+
+def load_images(images: List, max_side: Optional[int] = config.DECODE_MAX_SIDE) -> List[Optional[DecodedImage]]:
+    """
+    Decodes images in parallel.
+
+    Args:
+        images (list): Image paths, encoded buffers or pixel arrays. None entries and
+                       DecodedImage instances, e.g. from an earlier call, pass through.
+        max_side (int): Draft-mode decoding target, see `DecodedImage.load`.
+
+    Returns:
+        list: One DecodedImage per input, or None where the image is missing or decoding failed.
+    """
+    if all(image is None or isinstance(image, DecodedImage) for image in images):
+        return list(images)
+    return list(_executor.map(lambda image: _load_or_none(image, max_side), images))
@@ -0,0 +1,163 @@
+import json
+import logging
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Iterator, List, Optional
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+
+logger = logging.getLogger(__name__)
+
+
+class Job:
+    def __init__(self, studies: List[Dict[str, Any]], max_studies: Optional[int] = None):
+        """
+        A batch of studies processed in the background.
+
+        Results are appended in completion order as the chunks of the job finish.
+
+        Args:
+            studies (list): Studies in the `data` format of `getPrediction`.
+            max_studies (int): Passed on to `getPrediction`.
+        """
+        self.id = uuid.uuid4().hex
+        self.studies = studies
+        self.max_studies = max_studies
+        self.state = QUEUED
+        self.results = []
+        self.failed = 0
+        self.created = time.time()
+        self.started = None
+        self.finished = None
+        self._changed = threading.Condition()
+
+    def add_results(self, results: List[Dict[str, Any]]):
+        with self._changed:
+            self.results.extend(results)
+            self.failed += sum("error" in result for result in results)
+            self._changed.notify_all()
+
+    def set_state(self, state: str):
+        with self._changed:
+            self.state = state
+            if state == RUNNING:
+                self.started = time.time()
+            elif state == DONE:
+                self.finished = time.time()
+            self._changed.notify_all()
+
+    def status(self) -> Dict[str, Any]:
+        """Returns the state and progress of the job."""
+        with self._changed:
+            return {
+                "job_id": self.id,
+                "state": self.state,
+                "total": len(self.studies),
+                "completed": len(self.results),
+                "failed": self.failed,
+                "created": self.created,
+                "started": self.started,
+                "finished": self.finished,
+            }
+
+    def iter_results(self, poll_seconds: float = 15.0) -> Iterator[str]:
+        """
+        Yields the results of the job as NDJSON lines, blocking until each one is available.
+
+        Results already completed are yielded first. The iterator ends once the job is done.
+        An empty line is yielded every `poll_seconds` without progress to keep the connection alive.
+        """
+        sent = 0
+        while True:
+            with self._changed:
+                if sent == len(self.results) and self.state != DONE:
+                    self._changed.wait(timeout=poll_seconds)
+                pending = self.results[sent:]
+                finished = self.state == DONE
+
+            for result in pending:
+                yield json.dumps(result) + "\n"
+            sent += len(pending)
+
+            if finished and sent == len(self.results):
+                return
+            if not pending:
+                yield "\n"
+
+
+class JobManager:
+    def __init__(self, run_chunk: Callable[[List[Dict[str, Any]], Optional[int]], List[Dict[str, Any]]],
+                 workers: int = 1, chunk_size: int = 8, max_queued: int = 16, retention_seconds: float = 3600):
+        """
+        Runs batch jobs on a local worker pool.
+
+        Every job is split into chunks of `chunk_size` studies, each processed with one
+        `run_chunk` call so the models batch across the studies of a chunk.
+
+        Args:
+            run_chunk (callable): Called with a list of studies and `max_studies`, returns
+                                  one result per study.
+            workers (int): Number of jobs processed at the same time. The chunks of a job
+                           run one after the other.
+            chunk_size (int): Number of studies per `run_chunk` call.
+            max_queued (int): Number of unfinished jobs accepted before `submit` refuses new ones.
+            retention_seconds (float): How long finished jobs and their results are kept.
+        """
+        self.run_chunk = run_chunk
+        self.chunk_size = chunk_size
+        self.max_queued = max_queued
+        self.retention_seconds = retention_seconds
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="job-worker")
+        self._jobs = {}
+        self._lock = threading.Lock()
+
+    def submit(self, studies: List[Dict[str, Any]], max_studies: Optional[int] = None) -> Optional[Job]:
+        """
+        Queues a job.
+
+        Returns:
+            Job: The queued job, or None if too many jobs are unfinished.
+        """
+        with self._lock:
+            self._purge()
+            if sum(job.state != DONE for job in self._jobs.values()) >= self.max_queued:
+                return None
+            job = Job(studies, max_studies)
+            self._jobs[job.id] = job
+
+        self._executor.submit(self._run, job)
+        return job
+
+    def get(self, job_id: str) -> Optional[Job]:
+        """Returns a job by id, or None if it does not exist or has expired."""
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def stats(self) -> Dict[str, int]:
+        """Returns the number of known jobs in each state."""
+        with self._lock:
+            counts = {QUEUED: 0, RUNNING: 0, DONE: 0}
+            for job in self._jobs.values():
+                counts[job.state] += 1
+            return counts
+
+    def _purge(self):
+        cutoff = time.time() - self.retention_seconds
+        for job_id in [job_id for job_id, job in self._jobs.items() if job.finished and job.finished < cutoff]:
+            del self._jobs[job_id]
+
+    def _run(self, job: Job):
+        job.set_state(RUNNING)
+        for start in range(0, len(job.studies), self.chunk_size):
+            chunk = job.studies[start:start + self.chunk_size]
+            try:
+                results = self.run_chunk(chunk, job.max_studies)
+            except Exception as e:
+                logger.exception("Job %s failed on studies %d-%d: %s", job.id, start, start + len(chunk) - 1, e)
+                results = [{"uid": study.get("uid", "UnknownUID"), "error": str(e)} for study in chunk]
+            job.add_results(results)
+        job.set_state(DONE)
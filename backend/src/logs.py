@@ -0,0 +1,82 @@
+import atexit
+import json
+import logging
+import logging.handlers
+import queue
+from typing import Optional
+
+import config
+import forkSafe
+
+# Attributes every LogRecord has; anything else was passed with `extra=` and is logged as a field
+_RECORD_ATTRIBUTES = set(vars(logging.makeLogRecord({}))) | {"message", "asctime", "taskName"}
+
+_listener = None
+_handlers = None
+
+
+class JsonFormatter(logging.Formatter):
+    """Formats records as one JSON object per line, including fields passed with `extra=`."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "time": self.formatTime(record),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        entry.update({key: value for key, value in vars(record).items() if key not in _RECORD_ATTRIBUTES})
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+def _start_listener():
+    global _listener
+    handler, queue_handler = _handlers
+    queue_handler.queue = queue.SimpleQueue()
+    _listener = logging.handlers.QueueListener(queue_handler.queue, handler, respect_handler_level=True)
+    _listener.start()
+
+
+def stop_logging():
+    """
+    Writes out the records still queued and stops the writer thread. Processes that end
+    with os._exit, which skips atexit hooks, call this first so no records are lost.
+    """
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+def configure_logging(level: Optional[str] = None, fmt: Optional[str] = None):
+    """
+    Sets up the root logger. Records are handed to a background thread that writes them,
+    so request threads never block on log output.
+
+    Args:
+        level (str): Log level name, defaults to LOG_LEVEL.
+        fmt (str): "text" or "json", defaults to LOG_FORMAT.
+    """
+    global _handlers
+    fmt = fmt or config.LOG_FORMAT
+    handler = logging.StreamHandler()
+    if fmt == "json":
+        handler.setFormatter(JsonFormatter())
+    else:
+        handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(name)s: %(message)s"))
+
+    queue_handler = logging.handlers.QueueHandler(queue.SimpleQueue())
+    root = logging.getLogger()
+    root.handlers = [queue_handler]
+    root.setLevel((level or config.LOG_LEVEL).upper())
+
+    if _handlers is not None:
+        stop_logging()
+    else:
+        # Forked serving workers start their own writer thread
+        forkSafe.register_function(_start_listener)
+        atexit.register(stop_logging)
+    _handlers = (handler, queue_handler)
+    _start_listener()
@@ -3,71 +3,304 @@
 # It will be available at: http://127.0.0.1:8000
 # The endpoint /get-prediction will be at: http://127.0.0.1:8000/get-prediction
 
+import asyncio
+import base64
+import binascii
+import hashlib
+import json
+import logging
 import os
-import shutil
-from fastapi import FastAPI, File, UploadFile, Form
-from fastapi.responses import JSONResponse
+import queue
+import time
+from typing import List, Optional, Union
+
+from fastapi import FastAPI, File, HTTPException, UploadFile, Form
+from fastapi.responses import JSONResponse, Response, StreamingResponse
+from pydantic import BaseModel
 
 from predict import getPrediction
-from reportGenerator import ReportGenerator
-from cheXpert import CheXpert
-from summarizer import ClinicalTextSummarizer
-from utils import get_medical_studies
+from boundedExecutor import BoundedExecutor
+from cache import make_key
+from jobs import JobManager
+from logs import configure_logging
+from metrics import COALESCED_REQUESTS, REQUEST_SECONDS, render as render_metrics
+from cache import InferenceCache
+from models import create_registry, get_study_search
+from singleFlight import SingleFlight
+import config
+
+configure_logging()
+logger = logging.getLogger(__name__)
 
 app = FastAPI()
 
-report_generator = ReportGenerator()
-chexpert = CheXpert()
-summarizer = ClinicalTextSummarizer()
+inference_cache = InferenceCache(max_bytes=config.INFERENCE_CACHE_MAX_BYTES, disk_path=config.INFERENCE_CACHE_PATH or None)
 
-@app.post("/get-prediction")
-async def process_image_text(
-    uid: str = Form(...),
-    lateralImage: UploadFile = File(...),
-    frontalImage: UploadFile = File(...),
-    indications: str = Form(...),
-    maxStudies: int = Form(5, description="Maximum number of medical studies to return")
-):
-    
-    # Create a directory to save uploaded images if it doesn't exist
-    upload_dir = "assets/uploads"
-    os.makedirs(upload_dir, exist_ok=True)
+# Models load in the background while the server already accepts connections (or on first
+# use or readiness probe with MODEL_LOADING=lazy); /ready reports when all of them are loaded
+# and warmed up
+registry = create_registry(inference_cache)
+if config.MODEL_LOADING == "background":
+    registry.start()
+
+study_search = get_study_search(registry)
+
+inference_executor = BoundedExecutor(max_workers=config.INFERENCE_WORKERS, max_queue=config.INFERENCE_QUEUE_SIZE)
+
+# Identical /get-prediction requests in flight at the same time (double submits, client
+# retries after a timeout) share one computation
+single_flight = SingleFlight()
 
-    # Save lateral image
-    lateral_path = os.path.join(upload_dir, f"{uid}_lateral_{lateralImage.filename}")
-    with open(lateral_path, "wb") as buffer:
-        shutil.copyfileobj(lateralImage.file, buffer)
 
-    # Save frontal image
-    frontal_path = os.path.join(upload_dir, f"{uid}_frontal_{frontalImage.filename}")
-    with open(frontal_path, "wb") as buffer:
-        shutil.copyfileobj(frontalImage.file, buffer)
+def run_prediction(uid, lateral_image, frontal_image, indications, maxStudies, on_event=None, timings=False):
+    """Runs the blocking part of /get-prediction on an inference worker thread."""
 
     data = [
       {"uid": uid,
-        "lateral_images": [lateral_path],
-        "frontal_images": [frontal_path],
+        "lateral_images": [lateral_image],
+        "frontal_images": [frontal_image],
         "indications": indications}
       ]
 
-    # Call getPrediction with the saved image paths, indications, and uid
+    # Call getPrediction with the uploaded image buffers, indications, and uid
     result = getPrediction(
         data=data,
-        report_generator=report_generator,
-        chexpert=chexpert,
-        summarizer=summarizer
+        report_generator=registry.get("report_generator"),
+        chexpert=registry.get("chexpert"),
+        summarizer=registry.get("summarizer"),
+        max_studies=maxStudies,
+        speculative_studies=config.SPECULATIVE_STUDY_SEARCH,
+        study_search=study_search,
+        on_event=on_event,
+        timings=timings
     )
 
-    print("Final Result:", result)
+    logger.debug("Final result: %s", result, extra={"uid": uid})
 
+    return result
+
+
+def run_job_chunk(studies, maxStudies):
+    """Runs one chunk of the studies of a batch job on a job worker thread."""
+    return getPrediction(
+        data=studies,
+        report_generator=registry.get("report_generator"),
+        chexpert=registry.get("chexpert"),
+        summarizer=registry.get("summarizer"),
+        max_studies=maxStudies,
+        speculative_studies=config.SPECULATIVE_STUDY_SEARCH,
+        study_search=study_search
+    )
 
-    result[0]['medical_studies'] = get_medical_studies(indications + result[0]['findings'] + result[0]['impression'], max_results=maxStudies)
+job_manager = JobManager(
+    run_job_chunk,
+    workers=config.JOB_WORKERS,
+    chunk_size=config.JOB_CHUNK_SIZE,
+    max_queued=config.JOB_QUEUE_SIZE,
+    retention_seconds=config.JOB_RETENTION_SECONDS
+)
 
-    print("Final Result:", result)
 
-    
-    # Clean up uploaded files after processing
-    os.remove(lateral_path)
-    os.remove(frontal_path)
-    
+class JobImage(BaseModel):
+    path: Optional[str] = None
+    base64: Optional[str] = None
+
+class JobStudy(BaseModel):
+    uid: str
+    frontal_images: List[Union[str, JobImage]] = []
+    lateral_images: List[Union[str, JobImage]] = []
+    indications: str = ""
+
+class JobRequest(BaseModel):
+    studies: List[JobStudy]
+    maxStudies: Optional[int] = None
+
+
+def resolve_job_image(image):
+    """
+    Turns an image of a job request into a path or buffer getPrediction accepts.
+
+    Plain strings and {"path": ...} are file paths under JOB_IMAGE_ROOT, {"base64": ...} is
+    an encoded image.
+    """
+    if isinstance(image, JobImage) and image.base64 is not None:
+        try:
+            return base64.b64decode(image.base64, validate=True)
+        except binascii.Error:
+            raise HTTPException(status_code=400, detail="Invalid base64 image.")
+
+    path = image if isinstance(image, str) else image.path
+    if path is None:
+        raise HTTPException(status_code=400, detail="Every image needs a 'path' or 'base64'.")
+    if not config.JOB_IMAGE_ROOT:
+        raise HTTPException(status_code=400, detail="Image paths are disabled, send images as base64.")
+
+    root = os.path.realpath(config.JOB_IMAGE_ROOT)
+    resolved = os.path.realpath(os.path.join(root, path))
+    if os.path.commonpath([root, resolved]) != root:
+        raise HTTPException(status_code=400, detail=f"Image path '{path}' is outside the image root.")
+    return resolved
+
+
+@app.post("/get-prediction")
+async def process_image_text(
+    uid: str = Form(...),
+    lateralImage: UploadFile = File(...),
+    frontalImage: UploadFile = File(...),
+    indications: str = Form(...),
+    maxStudies: int = Form(5, description="Maximum number of medical studies to return"),
+    timings: bool = Form(False, description="Add the per-stage timing breakdown to the result")
+):
+    started = time.perf_counter()
+
+    # Uploads are kept in memory and handed to the models as buffers
+    lateral_image = await lateralImage.read()
+    frontal_image = await frontalImage.read()
+
+    def start():
+        return inference_executor.try_submit(
+            run_prediction, uid, lateral_image, frontal_image, indications, maxStudies, timings=timings
+        )
+
+    if config.COALESCE_REQUESTS:
+        key = make_key(
+            "get-prediction",
+            hashlib.sha256(lateral_image).hexdigest(),
+            hashlib.sha256(frontal_image).hexdigest(),
+            indications, maxStudies, timings
+        )
+        future, leader = single_flight.submit(key, start)
+        if not leader:
+            COALESCED_REQUESTS.inc()
+    else:
+        future, leader = start(), True
+
+    if future is None:
+        return JSONResponse(
+            status_code=503,
+            content={"detail": "Server is busy, please retry later."},
+            headers={"Retry-After": str(config.RETRY_AFTER_SECONDS)}
+        )
+
+    result = await asyncio.wrap_future(future)
+    if not leader:
+        # The shared result carries the uid of the request that computed it
+        result = [{**study, "uid": uid} for study in result]
+    REQUEST_SECONDS.labels(endpoint="/get-prediction").observe(time.perf_counter() - started)
+
     return JSONResponse(content=result)
+
+@app.post("/get-prediction/stream")
+async def process_image_text_stream(
+    uid: str = Form(...),
+    lateralImage: UploadFile = File(...),
+    frontalImage: UploadFile = File(...),
+    indications: str = Form(...),
+    maxStudies: int = Form(5, description="Maximum number of medical studies to return"),
+    timings: bool = Form(False, description="Add the per-stage timing breakdown to the result")
+):
+    """
+    Like /get-prediction, but streams partial results as NDJSON while they are computed.
+
+    CheXpert scores come first ('pathologies'), then the raw BLIP text of each view
+    ('report_token', 'report'), the summaries ('summary_token', 'summary') and the studies
+    ('studies'). The last line is a 'result' event with the /get-prediction response, or
+    an 'error' event.
+    """
+    started = time.perf_counter()
+    lateral_image = await lateralImage.read()
+    frontal_image = await frontalImage.read()
+
+    events = queue.Queue()
+    future = inference_executor.try_submit(
+        run_prediction, uid, lateral_image, frontal_image, indications, maxStudies, on_event=events.put, timings=timings
+    )
+    if future is None:
+        return JSONResponse(
+            status_code=503,
+            content={"detail": "Server is busy, please retry later."},
+            headers={"Retry-After": str(config.RETRY_AFTER_SECONDS)}
+        )
+    # Every event is queued before the prediction returns, so None marks the end of the stream
+    future.add_done_callback(lambda _: events.put(None))
+    future.add_done_callback(
+        lambda _: REQUEST_SECONDS.labels(endpoint="/get-prediction/stream").observe(time.perf_counter() - started)
+    )
+
+    def stream():
+        for event in iter(events.get, None):
+            yield json.dumps(event) + "\n"
+        try:
+            yield json.dumps({"event": "result", "results": future.result()}) + "\n"
+        except Exception as e:
+            yield json.dumps({"event": "error", "detail": str(e)}) + "\n"
+
+    return StreamingResponse(stream(), media_type="application/x-ndjson")
+
+@app.post("/jobs", status_code=202)
+async def submit_job(request: JobRequest):
+    studies = [
+        {"uid": study.uid,
+         "frontal_images": [resolve_job_image(image) for image in study.frontal_images],
+         "lateral_images": [resolve_job_image(image) for image in study.lateral_images],
+         "indications": study.indications}
+        for study in request.studies
+    ]
+
+    job = job_manager.submit(studies, request.maxStudies)
+    if job is None:
+        return JSONResponse(
+            status_code=503,
+            content={"detail": "Too many jobs in progress, please retry later."},
+            headers={"Retry-After": str(config.RETRY_AFTER_SECONDS)}
+        )
+    return job.status()
+
+@app.get("/jobs/{job_id}")
+async def job_status(job_id: str):
+    job = job_manager.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found.")
+    return job.status()
+
+@app.get("/jobs/{job_id}/results")
+async def job_results(job_id: str):
+    """Streams the results of a job as NDJSON, one study per line, as the studies complete."""
+    job = job_manager.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found.")
+    return StreamingResponse(job.iter_results(), media_type="application/x-ndjson")
+
+@app.get("/health")
+async def health():
+    return {
+        "status": "ok",
+        "in_flight": inference_executor.in_flight,
+        "capacity": inference_executor.max_workers + inference_executor.max_queue
+    }
+
+@app.get("/ready")
+async def ready():
+    # Starts loading models that are not loaded yet: with lazy loading behind a readiness gate
+    # no request would arrive to load them, and models that failed are retried after a delay
+    registry.start()
+    status_code = 200 if registry.ready else 503
+    return JSONResponse(status_code=status_code, content={"ready": registry.ready, "models": registry.status()})
+
+@app.get("/metrics")
+async def metrics():
+    """Prometheus metrics: stage and request latency histograms, queue waits, batch sizes and cache lookups."""
+    body, content_type = render_metrics()
+    return Response(content=body, media_type=content_type)
+
+@app.get("/stats")
+async def get_stats():
+    report_generator = registry.peek("report_generator")
+    member_stats = getattr(registry.peek("chexpert"), "member_stats", None)
+    return {
+        "report_batching": report_generator.batcher.stats() if report_generator else None,
+        "chexpert_ensemble": member_stats() if member_stats else None,
+        "inference_cache": inference_cache.stats(),
+        "coalescing": single_flight.stats(),
+        "jobs": job_manager.stats()
+    }
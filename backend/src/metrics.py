@@ -0,0 +1,74 @@
+# With PROMETHEUS_MULTIPROC_DIR set (serve.py sets it before forking its workers), every
+# process writes its metrics to files in that directory and /metrics aggregates all of them,
+# whichever worker serves the scrape. It must be set before prometheus_client is imported.
+import os
+
+from prometheus_client import CONTENT_TYPE_LATEST, CollectorRegistry, Counter, Histogram, generate_latest, multiprocess
+
+# Latency buckets from a cache hit to a slow generation on CPU, in seconds
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+
+STAGE_SECONDS = Histogram(
+    "args_stage_seconds",
+    "Duration of getPrediction stages: decode, chexpert, frontal_report, lateral_report, summaries and studies.",
+    ["stage"],
+    buckets=LATENCY_BUCKETS
+)
+REQUEST_SECONDS = Histogram(
+    "args_request_seconds",
+    "End-to-end duration of prediction requests, including the wait for a worker.",
+    ["endpoint"],
+    buckets=LATENCY_BUCKETS
+)
+QUEUE_WAIT_SECONDS = Histogram(
+    "args_queue_wait_seconds",
+    "Time work waits in a queue before it starts: 'inference' admission or a model micro-batcher.",
+    ["queue"],
+    buckets=LATENCY_BUCKETS
+)
+BATCH_SIZE = Histogram(
+    "args_batch_size",
+    "Number of items per micro-batch.",
+    ["queue"],
+    buckets=(1, 2, 4, 8, 16, 32, 64)
+)
+COALESCED_REQUESTS = Counter(
+    "args_coalesced_requests",
+    "Prediction requests that joined an identical request in flight instead of running the models."
+)
+ENSEMBLE_MEMBER_SECONDS = Histogram(
+    "args_ensemble_member_seconds",
+    "Duration of the forward pass of each CheXpert ensemble member on a batch.",
+    ["member"],
+    buckets=LATENCY_BUCKETS
+)
+CACHE_LOOKUPS = Counter(
+    "args_cache_lookups",
+    "Cache lookups by cache and result, e.g. memory_hit, disk_hit, hit or miss.",
+    ["cache", "result"]
+)
+
+
+def stage_label(stage: str) -> str:
+    """Drops the per-study suffix of a stage name, e.g. 'frontal_report:3' -> 'frontal_report'."""
+    return stage.split(":", 1)[0]
+
+
+def multiprocess_mode() -> bool:
+    """True if metrics are aggregated across the processes of a forked server."""
+    return bool(os.environ.get("PROMETHEUS_MULTIPROC_DIR"))
+
+
+def mark_process_dead(pid: int):
+    """Tells the multiprocess collector that a worker exited, so its live gauges are dropped."""
+    if multiprocess_mode():
+        multiprocess.mark_process_dead(pid)
+
+
+def render():
+    """Returns the current metrics in the Prometheus text format, with its content type."""
+    if multiprocess_mode():
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return generate_latest(registry), CONTENT_TYPE_LATEST
+    return generate_latest(), CONTENT_TYPE_LATEST
@@ -0,0 +1,165 @@
+import logging
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Callable, Dict, Optional
+
+import forkSafe
+
+logger = logging.getLogger(__name__)
+
+# Delay before a model that failed to load is retried, doubling with each failure up to the maximum
+RETRY_DELAY_SECONDS = 5.0
+MAX_RETRY_DELAY_SECONDS = 300.0
+
+
+class ModelRegistry:
+    def __init__(self):
+        """
+        Loads models lazily or in parallel in the background, and warms them up.
+
+        Models are registered with a factory and an optional warm-up function. They are
+        loaded either all at once by `start`, or one by one on their first `get`. A model
+        that failed to load is loaded again by the next `start` or `get` once its retry
+        delay has passed; until then they raise its error right away.
+        """
+        self._factories = {}
+        self._futures = {}
+        self._status = {}
+        self._failures = {}
+        self._lock = threading.Lock()
+        self._executor = None
+        # Models that fail to load in a forked serving worker are retried on a new loader pool
+        forkSafe.register(self, ModelRegistry._reset_executor)
+
+    def _reset_executor(self):
+        self._lock = threading.Lock()
+        self._executor = None
+
+    def register(self, name: str, factory: Callable[[], Any], warmup: Optional[Callable[[Any], Any]] = None):
+        """
+        Registers a model.
+
+        Args:
+            name (str): Name the model is looked up by.
+            factory (callable): Builds and returns the model.
+            warmup (callable): Called with the loaded model to run a synthetic inference
+                               before the model counts as ready.
+        """
+        with self._lock:
+            self._factories[name] = (factory, warmup)
+            self._status[name] = {"state": "registered"}
+
+    def _load(self, name: str, warmup: bool = True) -> Any:
+        factory, _ = self._factories[name]
+        status = self._status[name]
+
+        status["state"] = "loading"
+        started = time.perf_counter()
+        try:
+            model = factory()
+        except Exception as e:
+            self._failed(name, e)
+            logger.exception("Model '%s' failed to load: %s", name, e)
+            raise
+        status.pop("error", None)
+        status["load_seconds"] = round(time.perf_counter() - started, 3)
+        logger.info("Model '%s' loaded in %ss", name, status["load_seconds"])
+
+        if warmup:
+            self._warm_up(name, model)
+        else:
+            status["state"] = "loaded"
+        return model
+
+    def _warm_up(self, name: str, model: Any):
+        _, warmup = self._factories[name]
+        status = self._status[name]
+
+        if warmup is not None:
+            status["state"] = "warming_up"
+            started = time.perf_counter()
+            try:
+                warmup(model)
+            except Exception as e:
+                self._failed(name, e)
+                logger.exception("Model '%s' failed to warm up: %s", name, e)
+                raise
+            status["warmup_seconds"] = round(time.perf_counter() - started, 3)
+            logger.info("Model '%s' warmed up in %ss", name, status["warmup_seconds"])
+
+        status["state"] = "ready"
+        self._failures.pop(name, None)
+
+    def _failed(self, name: str, error: Exception):
+        failures = self._failures.get(name, (0, 0.0))[0] + 1
+        self._failures[name] = (failures, time.monotonic())
+        status = self._status[name]
+        status["state"] = "failed"
+        status["error"] = str(error)
+        status["failures"] = failures
+
+    def _retry_due(self, name: str) -> bool:
+        failures, failed_at = self._failures.get(name, (0, 0.0))
+        delay = min(MAX_RETRY_DELAY_SECONDS, RETRY_DELAY_SECONDS * 2 ** (failures - 1))
+        return time.monotonic() - failed_at >= delay
+
+    def _ensure_loading(self, name: str, warmup: bool = True) -> Future:
+        with self._lock:
+            if name not in self._factories:
+                raise KeyError(f"No model registered under '{name}'.")
+            future = self._futures.get(name)
+            # Drop a failed load once its retry delay has passed, so transient errors such
+            # as a download timeout do not fail the model for the life of the process
+            if future is not None and future.done() and future.exception() is not None and self._retry_due(name):
+                logger.info("Retrying to load model '%s'", name)
+                future = None
+            if future is None:
+                if self._executor is None:
+                    self._executor = ThreadPoolExecutor(thread_name_prefix="model-loader")
+                future = self._executor.submit(self._load, name, warmup)
+                self._futures[name] = future
+            return future
+
+    def start(self, wait: bool = False, warmup: bool = True):
+        """
+        Starts loading every registered model in parallel.
+
+        Args:
+            wait (bool): Block until all models are loaded (and warmed up).
+            warmup (bool): Warm the models up right after loading them. Without it, models
+                           stay in the 'loaded' state until `warm_up` is called.
+        """
+        futures = [self._ensure_loading(name, warmup) for name in list(self._factories)]
+        if wait:
+            for future in futures:
+                future.result()
+
+    def warm_up(self):
+        """Warms up, in the calling thread, every loaded model that is not ready yet."""
+        for name in list(self._factories):
+            if self._status[name]["state"] == "loaded":
+                self._warm_up(name, self._futures[name].result())
+
+    def get(self, name: str) -> Any:
+        """Returns a model, loading it first if needed. Blocks until it is ready."""
+        return self._ensure_loading(name).result()
+
+    def peek(self, name: str) -> Optional[Any]:
+        """Returns a model if it is ready, without loading it or waiting for it."""
+        future = self._futures.get(name)
+        if future is None or not future.done() or future.exception() is not None:
+            return None
+        return future.result()
+
+    def __contains__(self, name: str) -> bool:
+        return name in self._factories
+
+    @property
+    def ready(self) -> bool:
+        """True once every registered model is loaded and warmed up."""
+        return all(status["state"] == "ready" for status in self._status.values())
+
+    def status(self) -> Dict[str, Dict[str, Any]]:
+        """Returns the state and load/warm-up times of every model."""
+        return {name: dict(status) for name, status in self._status.items()}
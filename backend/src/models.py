@@ -0,0 +1,80 @@
+from typing import Callable, Dict, List, Optional
+
+import config
+from cache import InferenceCache
+from cheXpert import CheXpert
+from cheXpertEnsemble import CheXpertEnsemble, parse_members
+from modelRegistry import ModelRegistry
+from pathology import parse_thresholds
+from reportGenerator import ReportGenerator
+from studyIndex import StudyIndex
+from summarizer import ClinicalTextSummarizer
+from utils import get_medical_studies
+
+
+def create_chexpert(inference_cache: Optional[InferenceCache] = None) -> Callable[[], CheXpert]:
+    """Returns the loader of the CheXpert model, or of an ensemble if CHEXPERT_ENSEMBLE is set."""
+    options = dict(
+        cache=inference_cache,
+        precision=config.CHEXPERT_PRECISION,
+        backend=config.CHEXPERT_BACKEND,
+        thresholds=parse_thresholds(config.CHEXPERT_THRESHOLDS),
+        default_threshold=config.CHEXPERT_THRESHOLD
+    )
+    members = parse_members(config.CHEXPERT_ENSEMBLE)
+    if members:
+        return lambda: CheXpertEnsemble(members, concurrent=config.CHEXPERT_ENSEMBLE_CONCURRENT, **options)
+    return lambda: CheXpert(**options)
+
+
+def create_registry(inference_cache: Optional[InferenceCache] = None) -> ModelRegistry:
+    """
+    Registers the backend models, configured from `config`, without loading them.
+
+    Args:
+        inference_cache (InferenceCache): Cache shared by CheXpert and the report generator.
+
+    Returns:
+        ModelRegistry: Registry with 'report_generator', 'chexpert', 'summarizer' and,
+                       if STUDY_INDEX_DIR is set, 'study_index'.
+    """
+    registry = ModelRegistry()
+
+    registry.register(
+        "report_generator",
+        lambda: ReportGenerator(
+            max_batch_size=config.BLIP_MAX_BATCH_SIZE,
+            max_wait_ms=config.BLIP_MAX_WAIT_MS,
+            cache=inference_cache,
+            embedding_cache_bytes=config.BLIP_EMBEDDING_CACHE_MAX_BYTES,
+            precision=config.BLIP_PRECISION,
+            backend=config.BLIP_BACKEND
+        ),
+        ReportGenerator.warmup
+    )
+    registry.register("chexpert", create_chexpert(inference_cache), CheXpert.warmup)
+    registry.register(
+        "summarizer",
+        lambda: ClinicalTextSummarizer(
+            decoding=config.SUMMARIZER_DECODING,
+            batch_size=config.SUMMARIZER_BATCH_SIZE,
+            length_bucket=config.SUMMARIZER_LENGTH_BUCKET,
+            limit_bucket=config.SUMMARIZER_LIMIT_BUCKET,
+            tiered=config.SUMMARIZER_TIERED,
+            abstractive_budget=config.SUMMARIZER_ABSTRACTIVE_BUDGET,
+            precision=config.SUMMARIZER_PRECISION
+        ),
+        ClinicalTextSummarizer.warmup
+    )
+
+    if config.STUDY_INDEX_DIR:
+        registry.register("study_index", lambda: StudyIndex(config.STUDY_INDEX_DIR))
+
+    return registry
+
+
+def get_study_search(registry: ModelRegistry) -> Callable[..., List[Dict[str, str]]]:
+    """Returns the study search function: the local index when one is registered, otherwise PubMed."""
+    if "study_index" in registry:
+        return lambda query_text, max_results=5: registry.get("study_index").search(query_text, max_results=max_results)
+    return get_medical_studies
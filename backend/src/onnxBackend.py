@@ -0,0 +1,151 @@
+# ONNX Runtime inference backend for the DenseNet and the BLIP vision encoder.
+#
+# Graphs are exported once and cached on disk. Check that both backends agree:
+#   python onnxBackend.py --images sample1.jpg sample2.jpg
+
+import argparse
+import os
+import re
+import sys
+import threading
+
+import numpy as np
+import torch
+
+import config
+import forkSafe
+
+BACKENDS = ("torch", "onnx")
+
+
+def check_backend(backend: str, precision: str = "fp32"):
+    """Raises ValueError for unknown backends and for precisions the ONNX backend does not support."""
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown backend '{backend}', expected one of {BACKENDS}.")
+    if backend == "onnx" and precision != "fp32":
+        raise ValueError("The onnx backend only supports fp32 precision.")
+
+
+def onnx_path(name: str, cache_dir: str = config.ONNX_CACHE_DIR) -> str:
+    """Returns the path of the cached graph of a model name."""
+    return os.path.join(cache_dir, re.sub(r"[^A-Za-z0-9_.-]+", "_", name) + ".onnx")
+
+
+class OnnxModel:
+    def __init__(self, module: torch.nn.Module, example_input: torch.Tensor, path: str,
+                 intra_op_threads: int = config.ONNX_INTRA_OP_THREADS):
+        """
+        Runs a single-input, single-output torch module with ONNX Runtime.
+
+        The module is exported to `path` on first use, with a dynamic batch dimension;
+        later instances load the cached graph. The session, and with it the ONNX Runtime
+        thread pool, is created on the first call and re-created after a fork, so forked
+        serving workers never run a session whose threads only existed in the parent.
+
+        Args:
+            module (torch.nn.Module): The module to export, in evaluation mode.
+            example_input (torch.Tensor): Input used to trace the module.
+            path (str): Path of the cached .onnx graph.
+            intra_op_threads (int): ONNX Runtime intra-op threads. 0 uses torch's intra-op
+                                    thread count when the session is created, which
+                                    serve.py sets per worker.
+        """
+        if not os.path.exists(path):
+            self.export(module, example_input, path)
+
+        self.path = path
+        self.intra_op_threads = intra_op_threads
+        self._session = None
+        self._lock = threading.Lock()
+        # Forked serving workers create their own session, with their own thread count
+        forkSafe.register(self, OnnxModel._reset)
+
+    def _reset(self):
+        self._session = None
+        self._lock = threading.Lock()
+
+    @property
+    def session(self):
+        """The ONNX Runtime session, created on first use in the current process."""
+        if self._session is None:
+            with self._lock:
+                if self._session is None:
+                    import onnxruntime as ort
+
+                    options = ort.SessionOptions()
+                    options.intra_op_num_threads = self.intra_op_threads or torch.get_num_threads()
+                    options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+                    session = ort.InferenceSession(self.path, options, providers=["CPUExecutionProvider"])
+                    self.input_name = session.get_inputs()[0].name
+                    self.output_name = session.get_outputs()[0].name
+                    self._session = session
+        return self._session
+
+    @staticmethod
+    def export(module: torch.nn.Module, example_input: torch.Tensor, path: str):
+        """Exports the module to ONNX, writing to a temporary file first so a partial export is never cached."""
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with torch.no_grad():
+            torch.onnx.export(
+                module,
+                example_input,
+                tmp_path,
+                input_names=["input"],
+                output_names=["output"],
+                dynamic_axes={"input": {0: "batch"}, "output": {0: "batch"}},
+                opset_version=17
+            )
+        os.replace(tmp_path, path)
+
+    def __call__(self, tensor: torch.Tensor) -> torch.Tensor:
+        session = self.session
+        output = session.run([self.output_name], {self.input_name: tensor.detach().cpu().numpy()})[0]
+        return torch.from_numpy(output)
+
+
+
+class BlipVisionEncoder(torch.nn.Module):
+    """Exposes the last hidden state of a BLIP vision model as a single output."""
+
+    def __init__(self, vision_model: torch.nn.Module):
+        super().__init__()
+        self.vision_model = vision_model
+
+    def forward(self, pixel_values):
+        return self.vision_model(pixel_values=pixel_values)[0]
+
+
+def check_parity(images, model_name: str = "densenet121-res224-chex"):
+    """
+    Compares the pathology scores of the torch and onnx CheXpert backends.
+
+    Returns:
+        dict: Max and mean absolute score difference.
+    """
+    from cheXpert import CheXpert
+
+    ref = CheXpert(model_name=model_name).analyze_images(images).scores
+    cand = CheXpert(model_name=model_name, backend="onnx").analyze_images(images).scores
+    diff = np.abs(np.nan_to_num(ref) - np.nan_to_num(cand))
+    return {"max_abs_diff": float(diff.max()), "mean_abs_diff": float(diff.mean())}
+
+
+def main():
+    from imageLoader import load_images
+
+    parser = argparse.ArgumentParser(description="Compare CheXpert scores of the torch and onnx backends.")
+    parser.add_argument("--images", nargs="+", required=True, help="Sample chest X-ray images.")
+    parser.add_argument("--model", default="densenet121-res224-chex", help="torchxrayvision weights.")
+    parser.add_argument("--tolerance", type=float, default=1e-4, help="Largest tolerated absolute score difference.")
+    args = parser.parse_args()
+
+    parity = check_parity(load_images(args.images), args.model)
+    print(f"CheXpert torch vs onnx: {parity}")
+    if parity["max_abs_diff"] > args.tolerance:
+        print(f"Score difference exceeds {args.tolerance}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
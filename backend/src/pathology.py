@@ -0,0 +1,156 @@
+import warnings
+from typing import Dict, Iterable, List, Mapping, Optional, Sequence, Tuple, Union
+
+import numpy as np
+
+# torchxrayvision's default_pathologies, the output order of its DenseNets
+LABELS = (
+    "Atelectasis", "Consolidation", "Infiltration", "Pneumothorax", "Edema", "Emphysema", "Fibrosis",
+    "Effusion", "Pneumonia", "Pleural_Thickening", "Cardiomegaly", "Nodule", "Mass", "Hernia",
+    "Lung Lesion", "Fracture", "Lung Opacity", "Enlarged Cardiomediastinum",
+)
+
+DEFAULT_THRESHOLD = 0.8
+
+Thresholds = Union[float, Mapping[str, float], np.ndarray]
+
+
+def parse_thresholds(spec: str) -> Dict[str, float]:
+    """Parses per-pathology thresholds given as "Effusion=0.6,Pneumonia=0.7"."""
+    thresholds = {}
+    for item in spec.split(","):
+        if item.strip():
+            label, value = item.rsplit("=", 1)
+            thresholds[label.strip()] = float(value)
+    return thresholds
+
+
+def threshold_array(thresholds: Thresholds, labels: Sequence[str], default: float = DEFAULT_THRESHOLD) -> np.ndarray:
+    """
+    Returns one threshold per label.
+
+    Args:
+        thresholds: A single threshold for every label, per-label thresholds (labels not
+                    listed use `default`), or an array already aligned with `labels`.
+        labels (sequence): Label order of the result.
+        default (float): Threshold of the labels missing from a mapping.
+    """
+    if isinstance(thresholds, np.ndarray):
+        return thresholds
+    if isinstance(thresholds, Mapping):
+        unknown = set(thresholds) - set(labels)
+        if unknown:
+            raise ValueError(f"Thresholds given for unknown pathologies: {sorted(unknown)}")
+        return np.array([thresholds.get(label, default) for label in labels], dtype=np.float32)
+    return np.full(len(labels), thresholds, dtype=np.float32)
+
+
+class PathologyScores:
+    __slots__ = ("scores", "labels")
+
+    def __init__(self, scores: np.ndarray, labels: Sequence[str] = LABELS):
+        """
+        Pathology scores of several images (or studies), one row each, over a shared label index.
+
+        Scores that are unknown, e.g. pathologies a model was not trained on or images that
+        could not be read, are NaN.
+
+        Args:
+            scores (np.ndarray): Array of shape (rows, len(labels)).
+            labels (sequence): Pathology name of each column. Rows of all instances built
+                               from the same model share the same tuple.
+        """
+        scores = np.asarray(scores, dtype=np.float32)
+        if scores.ndim == 1:
+            scores = scores[None, :]
+        if scores.shape[1] != len(labels):
+            raise ValueError(f"Got {scores.shape[1]} scores per row for {len(labels)} labels.")
+        self.scores = scores
+        self.labels = labels if isinstance(labels, tuple) else tuple(labels)
+
+    @classmethod
+    def empty(cls, rows: int = 0, labels: Sequence[str] = LABELS) -> "PathologyScores":
+        """Returns `rows` rows of unknown (NaN) scores."""
+        return cls(np.full((rows, len(labels)), np.nan, dtype=np.float32), labels)
+
+    @classmethod
+    def concat(cls, parts: Iterable["PathologyScores"], labels: Sequence[str] = LABELS) -> "PathologyScores":
+        """Stacks the rows of several instances with the same labels."""
+        parts = list(parts)
+        if not parts:
+            return cls.empty(0, labels)
+        return cls(np.concatenate([part.scores for part in parts]), parts[0].labels)
+
+    def __len__(self) -> int:
+        return len(self.scores)
+
+    def __getitem__(self, index: Union[int, slice, Sequence[int]]) -> "PathologyScores":
+        """Selects rows; an integer index gives a single-row instance."""
+        if isinstance(index, (int, np.integer)):
+            index = slice(index, index + 1 if index != -1 else None)
+        return PathologyScores(self.scores[index], self.labels)
+
+    def __repr__(self) -> str:
+        return f"PathologyScores(rows={len(self)}, labels={len(self.labels)})"
+
+    def reindex(self, labels: Sequence[str]) -> "PathologyScores":
+        """Returns the scores over another label index, NaN for labels this instance lacks."""
+        labels = tuple(labels)
+        if labels == self.labels:
+            return self
+        columns = {label: i for i, label in enumerate(self.labels)}
+        scores = np.full((len(self), len(labels)), np.nan, dtype=np.float32)
+        for j, label in enumerate(labels):
+            if label in columns:
+                scores[:, j] = self.scores[:, columns[label]]
+        return PathologyScores(scores, labels)
+
+    def mean(self) -> "PathologyScores":
+        """Averages all rows into one, ignoring NaN. Labels without any score stay NaN."""
+        return self.group_mean([(0, len(self))])
+
+    def group_mean(self, spans: Sequence[Tuple[int, int]]) -> "PathologyScores":
+        """
+        Averages consecutive groups of rows, ignoring NaN, e.g. the images of each study.
+
+        Args:
+            spans (sequence): (start, end) row range of each group.
+
+        Returns:
+            PathologyScores: One row per span. Empty spans and labels without any score give NaN.
+        """
+        valid = ~np.isnan(self.scores)
+        sums = np.zeros((len(self) + 1, len(self.labels)), dtype=np.float64)
+        counts = np.zeros((len(self) + 1, len(self.labels)), dtype=np.int64)
+        np.cumsum(np.where(valid, self.scores, 0.0), axis=0, out=sums[1:])
+        np.cumsum(valid, axis=0, out=counts[1:])
+
+        starts = np.array([start for start, _ in spans], dtype=np.intp)
+        ends = np.array([end for _, end in spans], dtype=np.intp)
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore", RuntimeWarning)
+            means = (sums[ends] - sums[starts]) / (counts[ends] - counts[starts])
+        return PathologyScores(means.reshape(len(spans), len(self.labels)), self.labels)
+
+    def above(self, thresholds: Thresholds = DEFAULT_THRESHOLD) -> List[List[str]]:
+        """Returns, per row, the labels whose score reaches their threshold, in label order."""
+        mask = self.scores >= threshold_array(thresholds, self.labels)
+        return [[self.labels[j] for j in np.flatnonzero(row)] for row in mask]
+
+    def to_dicts(self, nan: Optional[float] = None) -> List[Dict[str, Optional[float]]]:
+        """
+        Converts each row to a {pathology: score} dict of Python floats, for JSON responses.
+
+        Args:
+            nan: Value of unknown scores (None serializes as JSON null).
+        """
+        return [
+            {label: nan if np.isnan(score) else float(score) for label, score in zip(self.labels, row.tolist())}
+            for row in self.scores
+        ]
+
+    def to_dict(self, nan: Optional[float] = None) -> Dict[str, Optional[float]]:
+        """Converts a single-row instance to a {pathology: score} dict, see `to_dicts`."""
+        if len(self) != 1:
+            raise ValueError(f"to_dict needs a single row, got {len(self)}.")
+        return self.to_dicts(nan)[0]
@@ -0,0 +1,108 @@
+import threading
+import time
+from concurrent.futures import Executor, FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Any, Callable, Dict, Iterable
+
+import config
+import forkSafe
+from metrics import STAGE_SECONDS, stage_label
+
+
+class StageGraph:
+    def __init__(self):
+        """
+        A small dependency graph of pipeline stages.
+
+        Each stage is a callable that receives the results of its dependencies as
+        positional arguments. Stages whose dependencies are all finished run
+        concurrently, so the graph takes about as long as its slowest branch.
+        """
+        self.stages = {}
+        self.timings = {}
+
+    def add(self, name: str, fn: Callable, deps: Iterable[str] = ()) -> str:
+        """
+        Adds a stage to the graph. Dependencies must already be part of the graph,
+        which keeps the graph acyclic.
+
+        Args:
+            name (str): Unique name of the stage.
+            fn (callable): Called with the results of `deps`, in order.
+            deps (iterable): Names of the stages this stage depends on.
+
+        Returns:
+            str: The name of the stage, for use in later `deps`.
+        """
+        deps = tuple(deps)
+        if name in self.stages:
+            raise ValueError(f"Stage '{name}' is already part of the graph.")
+        missing = [dep for dep in deps if dep not in self.stages]
+        if missing:
+            raise ValueError(f"Stage '{name}' depends on unknown stages: {missing}")
+        self.stages[name] = (fn, deps)
+        return name
+
+    def _run_stage(self, name, fn, args):
+        started = time.perf_counter()
+        try:
+            return fn(*args)
+        finally:
+            self.timings[name] = time.perf_counter() - started
+            STAGE_SECONDS.labels(stage=stage_label(name)).observe(self.timings[name])
+
+    def run(self, executor: Executor = None) -> Dict[str, Any]:
+        """
+        Runs every stage once its dependencies have finished.
+
+        Args:
+            executor (Executor): Executor the stages run on. Defaults to the shared
+                                 pipeline executor.
+
+        Returns:
+            dict: Maps each stage name to its result. If a stage raises, stages that
+                  have not started yet are cancelled and the exception is re-raised.
+        """
+        executor = executor or get_executor()
+        results = {}
+        pending = dict(self.stages)
+        running = {}
+
+        try:
+            while pending or running:
+                for name, (fn, deps) in list(pending.items()):
+                    if all(dep in results for dep in deps):
+                        del pending[name]
+                        args = [results[dep] for dep in deps]
+                        running[executor.submit(self._run_stage, name, fn, args)] = name
+
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    results[running.pop(future)] = future.result()
+        finally:
+            for future in running:
+                future.cancel()
+
+        return results
+
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def _reset_executor():
+    global _executor, _executor_lock
+    _executor = None
+    _executor_lock = threading.Lock()
+
+
+# Forked serving workers create their own stage pool on first use
+forkSafe.register_function(_reset_executor)
+
+
+def get_executor() -> Executor:
+    """Returns the thread pool shared by all stage graphs."""
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=config.PIPELINE_WORKERS, thread_name_prefix="pipeline")
+    return _executor
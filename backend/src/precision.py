@@ -0,0 +1,119 @@
+# Reduced-precision inference for the backend models, and a drift check against fp32.
+#
+# Compare a precision mode against fp32 on a fixed sample set:
+#   python precision.py --precision int8 --images sample1.jpg sample2.jpg
+
+import argparse
+import sys
+
+import numpy as np
+import torch
+
+PRECISIONS = ("fp32", "bf16", "int8")
+
+# Fixed texts the summarizer drift is measured on
+SAMPLE_TEXTS = [
+    "The heart size is normal. The lungs are clear. \nNo pleural effusion or pneumothorax. \n"
+    "Pathologies Found are cardiomegaly, effusion. \n",
+    "There is a right lower lobe consolidation. \nThe cardiomediastinal silhouette is within normal limits. \n"
+    "Pathologies Found are pneumonia, consolidation, lung opacity. \n",
+    "Low lung volumes with bibasilar atelectasis. \nMild pulmonary vascular congestion. \n"
+    "Pathologies Found are atelectasis, edema. \n",
+]
+
+
+def check_precision(precision: str):
+    """Raises ValueError for unknown precision modes."""
+    if precision not in PRECISIONS:
+        raise ValueError(f"Unknown precision '{precision}', expected one of {PRECISIONS}.")
+
+
+def apply_precision(model: torch.nn.Module, precision: str) -> torch.nn.Module:
+    """
+    Converts a model to the given precision.
+
+    Args:
+        model (torch.nn.Module): Model in fp32, in evaluation mode.
+        precision (str): "fp32" leaves the model unchanged, "bf16" casts its weights to
+                         bfloat16 and "int8" dynamically quantizes its linear layers
+                         (CPU only; other layers stay in fp32).
+
+    Returns:
+        torch.nn.Module: The converted model.
+    """
+    check_precision(precision)
+    if precision == "bf16":
+        return model.to(torch.bfloat16)
+    if precision == "int8":
+        return torch.ao.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+    return model
+
+
+def input_dtype(precision: str) -> torch.dtype:
+    """Returns the dtype floating point model inputs must have for the given precision."""
+    return torch.bfloat16 if precision == "bf16" else torch.float32
+
+
+def compare_chexpert(reference, candidate, images):
+    """Returns the max and mean absolute difference of the pathology scores."""
+    ref = reference.analyze_images(images).scores
+    cand = candidate.analyze_images(images).scores
+    diff = np.abs(np.nan_to_num(ref) - np.nan_to_num(cand))
+    return {"max_abs_diff": float(diff.max()), "mean_abs_diff": float(diff.mean())}
+
+
+def _token_jaccard(a: str, b: str) -> float:
+    a, b = set(a.lower().split()), set(b.lower().split())
+    return len(a & b) / len(a | b) if a | b else 1.0
+
+
+def compare_texts(reference, candidate):
+    """Returns the share of identical texts and their mean token Jaccard similarity."""
+    pairs = list(zip(reference, candidate))
+    return {
+        "exact_match": sum(a == b for a, b in pairs) / len(pairs),
+        "mean_token_jaccard": float(np.mean([_token_jaccard(a, b) for a, b in pairs])),
+    }
+
+
+def main():
+    from cheXpert import CheXpert
+    from imageLoader import load_images
+    from reportGenerator import ReportGenerator
+    from summarizer import ClinicalTextSummarizer
+
+    parser = argparse.ArgumentParser(description="Measure output drift of a precision mode against fp32.")
+    parser.add_argument("--precision", required=True, choices=[p for p in PRECISIONS if p != "fp32"])
+    parser.add_argument("--images", nargs="+", required=True, help="Sample chest X-ray images.")
+    parser.add_argument("--indication", default="cough and fever", help="Indication used for report generation.")
+    parser.add_argument("--max-score-drift", type=float, default=0.05,
+                        help="Largest tolerated absolute difference of a CheXpert score.")
+    args = parser.parse_args()
+
+    images = load_images(args.images)
+
+    chexpert_drift = compare_chexpert(CheXpert(), CheXpert(precision=args.precision), images)
+    print(f"CheXpert: {chexpert_drift}")
+
+    def reports(generator):
+        return [" ".join(generator.generate_report(image, args.indication, "Sample")) for image in images]
+    report_drift = compare_texts(
+        reports(ReportGenerator(device="cpu", cache=None, embedding_cache_bytes=0)),
+        reports(ReportGenerator(device="cpu", cache=None, embedding_cache_bytes=0, precision=args.precision))
+    )
+    print(f"ReportGenerator: {report_drift}")
+
+    jobs = [(text, 5, 60) for text in SAMPLE_TEXTS]
+    summary_drift = compare_texts(
+        ClinicalTextSummarizer(decoding="greedy").summarize_batch(jobs),
+        ClinicalTextSummarizer(decoding="greedy", precision=args.precision).summarize_batch(jobs)
+    )
+    print(f"ClinicalTextSummarizer: {summary_drift}")
+
+    if chexpert_drift["max_abs_diff"] > args.max_score_drift:
+        print(f"CheXpert score drift exceeds {args.max_score_drift}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,149 +1,292 @@
-import os
-from typing import List, Dict, Any
+import logging
+from typing import List, Dict, Any, Callable, Optional
 from reportGenerator import ReportGenerator
 from cheXpert import CheXpert
 from summarizer import ClinicalTextSummarizer
+from pipeline import StageGraph
+from imageLoader import load_images
+from pathology import DEFAULT_THRESHOLD, PathologyScores, Thresholds
+
+from utils import (get_summary_params,
+                   replace_indication_placeholder,
+                   chexpert_preds_to_text,
+                   get_largest_image,
+                   get_image_size,
+                   get_medical_studies,
+                   ImageInput)
+
+logger = logging.getLogger(__name__)
+
+def generate_view_report(report_generator: ReportGenerator, images: List[ImageInput], indication: str, image_type: str, uid: str,
+                         on_text: Optional[Callable[[str], None]] = None):
+    """
+    Generates findings and impression from the largest image of one view.
 
-from utils import (get_summary_params, 
-                   replace_indication_placeholder, 
-                   aggregate_chexpert_predictions, 
-                   chexpert_preds_to_text, 
-                   get_largest_image)
+    Args:
+        on_text (callable): If given, receives the raw report text as it is generated.
 
-def getPrediction(data: List[Dict[str, str]], report_generator: ReportGenerator, chexpert: CheXpert, summarizer: ClinicalTextSummarizer) -> List[Dict[str, Any]]:
+    Returns:
+        tuple: The generated (findings, impression), or empty strings if the view has no valid image.
     """
-    Processes chest X-ray data to generate summarized findings and impressions.
+    if not images:
+        return "", ""
+
+    # Find largest image of the view
+    largest_image = get_largest_image(images)
+
+    if largest_image is not None and get_image_size(largest_image) >= 0:
+        gen_findings, gen_impression = report_generator.generate_report(
+            largest_image, indication, image_type, on_text=on_text
+        )
+        logger.debug("%s findings %s, impression %s", image_type, gen_findings, gen_impression, extra={"uid": uid})
+        return gen_findings, gen_impression
+
+    logger.warning("No valid %s image found for UID %s among %d images", image_type.lower(), uid, len(images))
+    return "", ""
+
+def summary_jobs(chex_scores: PathologyScores, frontal_report, lateral_report, thresholds: Thresholds = DEFAULT_THRESHOLD):
+    """
+    Builds the summarization jobs of a study, combining generated and CheXpert text.
 
     Args:
-        data (list): List of dictionaries, each representing a patient entry
-                     with uid, image paths, and indications (as per contract).
-        report_generator (ReportGenerator): An instance of the ReportGenerator class.
-        chexpert (CheXpert): An instance of the CheXpert class.
-        summarizer (ClinicalTextSummarizer): An instance of the ClinicalTextSummarizer class.
+        chex_scores (PathologyScores): The aggregated CheXpert scores of the study, a single row.
+        thresholds (float or array): Score at or above which a pathology is mentioned.
 
     Returns:
-        list: List of dictionaries, each with uid, generated findings, and impression.
-              Returns 'N/A' for findings/impression if no relevant images are found or
-              processing fails.
+        list: The findings and impression jobs as (text, min_length, max_length) tuples.
     """
-    results = []
+    fron_gen_findings, fron_gen_impression = frontal_report
+    lat_gen_findings, lat_gen_impression = lateral_report
 
-    for data_point in data:
-        uid = data_point.get('uid', 'UnknownUID')
-        frontal_images = data_point.get('frontal_images', [])
-        lateral_images = data_point.get('lateral_images', [])
-        indication = data_point.get('indications', '')
-        indication = replace_indication_placeholder(indication, "")
+    chex_text = chexpert_preds_to_text(chex_scores, thresholds)
 
-        final_findings = ""
-        final_impression = ""
+    logger.debug("CheXpert pathologies: %s", chex_text)
 
+    findings_combined_text = ""
+    if fron_gen_findings != "":
+        findings_combined_text += f"{fron_gen_findings}. \n"
+    if lat_gen_findings != "":
+        findings_combined_text += f"{lat_gen_findings}. \n"
+    if chex_text != "":
+        findings_combined_text += f"Pathologies Found are {chex_text}. \n"
 
-        # 1 Find Pathologies using Chexpert
-        chex_preds = []
+    logger.debug("Findings combined: %s", findings_combined_text)
 
-        for img in frontal_images:
-            chex_preds.append(chexpert.analyze_image(img))
+    findings_summary_params = get_summary_params(fron_gen_findings, lat_gen_findings, chex_text)
+    min_findings_length = findings_summary_params["min_length"]
+    max_findings_length = findings_summary_params["max_length"]
 
-        for img in lateral_images:
-            chex_preds.append(chexpert.analyze_image(img))
+    impression_combined_text = ""
+    if fron_gen_impression != "":
+        impression_combined_text += f"{fron_gen_impression}. \n"
+    if lat_gen_impression != "":
+        impression_combined_text += f"{lat_gen_impression}. \n"
+    if chex_text != "":
+        impression_combined_text += f"Pathologies Found are {chex_text}. \n"
 
-        chex_aggreated_preds = aggregate_chexpert_predictions(chex_preds)
-        chex_text = chexpert_preds_to_text(chex_aggreated_preds)
+    logger.debug("Impression combined: %s", impression_combined_text)
 
-        print("CHEX", chex_text)
-        print("-"*20)
+    impression_summary_params = get_summary_params(fron_gen_impression, lat_gen_impression, chex_text)
+    min_impression_length = impression_summary_params["min_length"]
+    max_impression_length = impression_summary_params["max_length"]
 
-        # 2. Generate Frontal and Lateral Findings
-        if frontal_images:
-            # Find largest frontal image
-            largest_frontal_image_path = get_largest_image(frontal_images)
+    return [
+        (findings_combined_text, min_findings_length, max_findings_length),
+        (impression_combined_text, min_impression_length, max_impression_length)
+    ]
 
-            if largest_frontal_image_path and os.path.exists(largest_frontal_image_path):
+def summarize_studies(summarizer: ClinicalTextSummarizer, study_scores: PathologyScores, reports,
+                      uids: Optional[List[str]] = None, on_event: Optional[Callable[[Dict[str, Any]], None]] = None,
+                      thresholds: Thresholds = DEFAULT_THRESHOLD):
+    """
+    Summarizes the findings and impressions of every study with one batched summarizer call.
 
-                fron_gen_findings, fron_gen_impression = report_generator.generate_report(
-                    largest_frontal_image_path, indication, "Frontal"
-                )
-                print(f"Frontal Findings {fron_gen_findings}, impression {fron_gen_impression}")
-                print("-"*20)
+    Args:
+        study_scores (PathologyScores): Aggregated CheXpert scores, one row per study.
+        reports (list): (frontal_report, lateral_report) of each study.
+        uids (list): uid of each study, used in the events.
+        on_event (callable): If given, the summaries are generated one at a time and streamed
+                             as 'summary_token' events, each followed by a 'summary' event.
+        thresholds (float or array): Score at or above which a pathology is mentioned.
 
-            else:
-                 print(f"Warning: No valid frontal image found for UID {uid} among paths: {frontal_images}")
+    Returns:
+        list: The summarized (findings, impression) of each study, each as a (summary, tier) tuple.
+    """
+    jobs = []
+    for i, (frontal_report, lateral_report) in enumerate(reports):
+        jobs.extend(summary_jobs(study_scores[i], frontal_report, lateral_report, thresholds))
+
+    if on_event is None:
+        summaries = summarizer.summarize_tiered(jobs)
+    else:
+        # Streaming decodes one sequence at a time, so the jobs are not batched
+        summaries = []
+        for i, (text, min_length, max_length) in enumerate(jobs):
+            uid, section = uids[i // 2], ("findings", "impression")[i % 2]
+            summary, tier = summarizer.summarize_stream(
+                text, min_length, max_length,
+                on_text=lambda piece, uid=uid, section=section:
+                    on_event({"event": "summary_token", "uid": uid, "section": section, "text": piece})
+            )
+            on_event({"event": "summary", "uid": uid, "section": section, "text": summary, "tier": tier})
+            summaries.append((summary, tier))
+
+    return [(summaries[i], summaries[i + 1]) for i in range(0, len(summaries), 2)]
+
+def study_timings(stage_timings: Dict[str, float], index: int) -> Dict[str, float]:
+    """Picks the stage durations of one study from the timings of a stage graph, without the study suffix."""
+    return {
+        name.split(":", 1)[0]: round(seconds, 4)
+        for name, seconds in stage_timings.items()
+        if ":" not in name or name.endswith(f":{index}")
+    }
+
+def getPrediction(data: List[Dict[str, str]], report_generator: ReportGenerator, chexpert: CheXpert, summarizer: ClinicalTextSummarizer,
+                  max_studies: Optional[int] = None, speculative_studies: bool = False,
+                  study_search: Callable[..., List[Dict[str, str]]] = get_medical_studies,
+                  on_event: Optional[Callable[[Dict[str, Any]], None]] = None,
+                  timings: bool = False) -> List[Dict[str, Any]]:
+    """
+    Processes chest X-ray data to generate summarized findings and impressions.
 
+    The work is expressed as a stage graph. Every image is decoded once and shared by
+    both models; then CheXpert on all images, BLIP on the frontal and lateral view of
+    every study and, optionally, the study search run concurrently. The findings and
+    impressions of all studies are summarized together in one batched call.
 
-        if lateral_images:
-            # Find largest lateral image
-            largest_lateral_image_path = get_largest_image(lateral_images)
+    Args:
+        data (list): List of dictionaries, each representing a patient entry
+                     with uid, images, and indications (as per contract). Images
+                     may be file paths or in-memory buffers (bytes, memoryview or
+                     decoded np.ndarray).
+        report_generator (ReportGenerator): An instance of the ReportGenerator class.
+        chexpert (CheXpert): An instance of the CheXpert class.
+        summarizer (ClinicalTextSummarizer): An instance of the ClinicalTextSummarizer class.
+        max_studies (int): If given, each result also gets up to this many 'medical_studies'.
+        speculative_studies (bool): Search studies from the indications alone, concurrently
+                                    with the models, instead of from the final report.
+        study_search (callable): Called with the query text and `max_results`.
+        on_event (callable): If given, called from the stage threads with partial results as
+                             they become available: 'pathologies' per study, 'report_token'
+                             and 'report' per view, 'summary_token' and 'summary' per section
+                             and 'studies' per study. Every event has an 'event' type and a 'uid'.
+        timings (bool): Add the duration in seconds of each stage of a study to its result
+                        ('timings'). Stages shared by all studies report the shared duration.
 
-            if largest_lateral_image_path and os.path.exists(largest_lateral_image_path):
+    Returns:
+        list: List of dictionaries, each with uid, generated findings, and impression,
+              and the summarization tier used for each ('summary_tiers').
+              Returns 'N/A' for findings/impression if no relevant images are found or
+              processing fails.
+    """
+    graph = StageGraph()
 
-                # 2. Use largest image and indication with report generator
-                lat_gen_findings, lat_gen_impression = report_generator.generate_report(
-                    largest_lateral_image_path, indication, "Lateral"
-                )
-                print(f"Lateral Findings {lat_gen_findings}, impression {lat_gen_impression}")
-                print("-"*20)
+    # 0 Decode every image once, shared by CheXpert and the report generator
+    all_images = []
+    image_spans = []
+    for data_point in data:
+        start = len(all_images)
+        all_images.extend(data_point.get('frontal_images', []))
+        middle = len(all_images)
+        all_images.extend(data_point.get('lateral_images', []))
+        image_spans.append((start, middle, len(all_images)))
+
+    decode_stage = graph.add("decode", lambda: load_images(all_images))
+
+    uids = [data_point.get('uid', 'UnknownUID') for data_point in data]
+
+    # 1 Find Pathologies using Chexpert, batching every view of every study together, and
+    # average the scores of each study's images in one vectorized step
+    def run_chexpert(decoded):
+        study_scores = chexpert.analyze_images(decoded).group_mean([(start, end) for start, _, end in image_spans])
+        if on_event is not None:
+            for uid, scores in zip(uids, study_scores.to_dicts()):
+                on_event({"event": "pathologies", "uid": uid, "scores": scores})
+        return study_scores
+
+    chexpert_stage = graph.add("chexpert", run_chexpert, deps=(decode_stage,))
+
+    def run_view_report(images, indication, image_type, uid):
+        if on_event is None:
+            return generate_view_report(report_generator, images, indication, image_type, uid)
+        view = image_type.lower()
+        findings, impression = generate_view_report(
+            report_generator, images, indication, image_type, uid,
+            on_text=lambda piece: on_event({"event": "report_token", "uid": uid, "view": view, "text": piece})
+        )
+        on_event({"event": "report", "uid": uid, "view": view, "findings": findings, "impression": impression})
+        return findings, impression
+
+    report_stages = []
+    for i, (data_point, (start, middle, end)) in enumerate(zip(data, image_spans)):
+        uid = data_point.get('uid', 'UnknownUID')
+        indication = replace_indication_placeholder(data_point.get('indications', ''), "")
 
+        # 2. Generate Frontal and Lateral Findings
+        frontal_stage = graph.add(
+            f"frontal_report:{i}",
+            lambda decoded, start=start, middle=middle, indication=indication, uid=uid:
+                run_view_report(decoded[start:middle], indication, "Frontal", uid),
+            deps=(decode_stage,)
+        )
+        lateral_stage = graph.add(
+            f"lateral_report:{i}",
+            lambda decoded, middle=middle, end=end, indication=indication, uid=uid:
+                run_view_report(decoded[middle:end], indication, "Lateral", uid),
+            deps=(decode_stage,)
+        )
+        report_stages.extend((frontal_stage, lateral_stage))
+
+    # 3. Summarize findings and impressions of all studies in one batch once CheXpert and every view are done
+    summaries_stage = graph.add(
+        "summaries",
+        lambda study_scores, *reports:
+            summarize_studies(summarizer, study_scores, list(zip(reports[0::2], reports[1::2])), uids, on_event,
+                              chexpert.thresholds),
+        deps=(chexpert_stage, *report_stages)
+    )
+
+    # 4. Search related studies
+    def search_studies(uid, query):
+        studies = study_search(query, max_results=max_studies)
+        if on_event is not None:
+            on_event({"event": "studies", "uid": uid, "medical_studies": studies})
+        return studies
+
+    studies_stages = []
+    for i, data_point in enumerate(data):
+        raw_indication = data_point.get('indications', '')
+        studies_stage = None
+        if max_studies is not None:
+            if speculative_studies:
+                studies_stage = graph.add(
+                    f"studies:{i}",
+                    lambda uid=uids[i], query=replace_indication_placeholder(raw_indication, ""): search_studies(uid, query)
+                )
             else:
-                 print(f"Warning: No valid lateral image found for UID {uid} among paths: {lateral_images}")
-
-
-        # 3. Summarize findings and impressions (combining generated and CheXpert text)
-        findings_combined_text = ""
-        if fron_gen_findings != "":
-            findings_combined_text += f"{fron_gen_findings}. \n"
-        if lat_gen_findings != "":
-            findings_combined_text += f"{lat_gen_findings}. \n"
-        if chex_text != "":
-            findings_combined_text += f"Pathologies Found are {chex_text}. \n"
-
-        print("Findings_combined: ", findings_combined_text)
-
-        findings_summary_params = get_summary_params(fron_gen_findings, lat_gen_findings, chex_text)
-        min_findings_length = findings_summary_params["min_length"]
-        max_findings_length = findings_summary_params["max_length"]
-        final_findings = summarizer.summarize(findings_combined_text, min_findings_length, max_findings_length)
-
-        impression_combined_text = ""
-        if fron_gen_impression != "":
-            impression_combined_text += f"{fron_gen_impression}. \n"
-        if lat_gen_impression != "":
-            impression_combined_text += f"{lat_gen_impression}. \n"
-        if chex_text != "":
-            impression_combined_text += f"Pathologies Found are {chex_text}. \n"
-
-        print("Impression_combined: ", impression_combined_text)
-
-        impression_summary_params = get_summary_params(fron_gen_impression, lat_gen_impression, chex_text)
-        min_impression_length = impression_summary_params["min_length"]
-        max_impression_length = impression_summary_params["max_length"]
-        final_impression = summarizer.summarize(impression_combined_text, min_impression_length, max_impression_length)
-
-        # Combine findings and impressions (this is a simple concatenation, could be more complex)
-        # Since the contract asks for 'findings' and 'impression' for the UID, we can combine
-        # the summarized results from frontal and lateral views if both exist.
-        # If only one view exists, use that view's summary.
-        # final_findings = ""
-        # final_impression = ""
-
-        # if frontal_findings != "N/A" and lateral_findings != "N/A":
-        #     final_findings = f"Frontal Findings: {frontal_findings} Lateral Findings: {lateral_findings}"
-        #     final_impression = f"Frontal Impression: {frontal_impression} Lateral Impression: {lateral_impression}"
-        # elif frontal_findings != "N/A":
-        #     final_findings = frontal_findings
-        #     final_impression = frontal_impression
-        # elif lateral_findings != "N/A":
-        #     final_findings = lateral_findings
-        #     final_impression = lateral_impression
-        # else:
-        #      final_findings = "No image data found for analysis."
-        #      final_impression = "No image data found for analysis."
-
-
-        results.append({
-            'uid': uid,
-            'findings': final_findings,
-            'impression': final_impression
-        })
+                studies_stage = graph.add(
+                    f"studies:{i}",
+                    lambda summaries, i=i, query=raw_indication:
+                        search_studies(uids[i], query + summaries[i][0][0] + summaries[i][1][0]),
+                    deps=(summaries_stage,)
+                )
+        studies_stages.append(studies_stage)
+
+    stage_results = graph.run()
 
-    return results
\ No newline at end of file
+    results = []
+    for i, (data_point, summaries, studies_stage) in enumerate(zip(data, stage_results[summaries_stage], studies_stages)):
+        (final_findings, findings_tier), (final_impression, impression_tier) = summaries
+        result = {
+            'uid': data_point.get('uid', 'UnknownUID'),
+            'findings': final_findings,
+            'impression': final_impression,
+            'summary_tiers': {'findings': findings_tier, 'impression': impression_tier}
+        }
+        if studies_stage is not None:
+            result['medical_studies'] = stage_results[studies_stage]
+        if timings:
+            result['timings'] = study_timings(graph.timings, i)
+        results.append(result)
+
+    return results
@@ -0,0 +1,185 @@
+import logging
+import threading
+import time
+import xml.etree.ElementTree as ET
+from typing import Dict, List, Optional
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+import config
+from cache import DiskCache, make_key
+from metrics import CACHE_LOOKUPS
+
+logger = logging.getLogger(__name__)
+
+
+# PubMed only treats these as boolean operators in uppercase
+_OPERATORS = {"AND", "OR", "NOT"}
+
+
+def normalize_query(query_text: str) -> str:
+    """
+    Lowercases a query and collapses whitespace, so near-identical queries share cache entries.
+
+    Only used for cache keys. Uppercase boolean operators keep their case, since PubMed reads
+    "a AND b" differently from "a and b".
+    """
+    words = str(query_text).split()
+    return " ".join(word if word in _OPERATORS else word.lower() for word in words)
+
+
+def parse_article(article: ET.Element) -> Dict[str, str]:
+    """Extracts title, top authors, abstract and link from a PubmedArticle element."""
+    title_elem = article.find(".//ArticleTitle")
+    abstract_elem = article.find(".//AbstractText")
+    authors = article.findall(".//Author")
+    author_names = []
+    for author in authors:
+        last = author.find("LastName")
+        fore = author.find("ForeName")
+        if last is not None and fore is not None:
+            author_names.append(f"{fore.text} {last.text}")
+    title = title_elem.text if title_elem is not None else "No title"
+    abstract = abstract_elem.text if abstract_elem is not None else "No abstract available"
+    pubmed_id = article.find(".//PMID").text
+    return {
+        "title": title,
+        "authors": author_names[:3],  # just top 3 authors
+        "abstract": abstract,
+        "link": f"https://pubmed.ncbi.nlm.nih.gov/{pubmed_id}/"
+    }
+
+
+class PubMedClient:
+    def __init__(self, base_url: str = config.PUBMED_BASE_URL, timeout: float = config.PUBMED_TIMEOUT,
+                 retries: int = config.PUBMED_RETRIES, requests_per_second: float = config.PUBMED_REQUESTS_PER_SECOND,
+                 cache_path: Optional[str] = config.PUBMED_CACHE_PATH, cache_ttl: float = config.PUBMED_CACHE_TTL_SECONDS,
+                 api_key: Optional[str] = config.NCBI_API_KEY):
+        """
+        Client for the NCBI E-utilities with a pooled session and a persistent cache.
+
+        Args:
+            base_url (str): Base URL of the E-utilities, e.g. a local stand-in server in tests.
+            timeout (float): Connect and read timeout of each request, in seconds.
+            retries (int): Retries of failed requests. 429 and 5xx responses are retried
+                           with exponential backoff, honouring Retry-After.
+            requests_per_second (float): Client-side request rate limit (NCBI allows 3/s
+                                         without an API key and 10/s with one).
+            cache_path (str): SQLite file caching search results and parsed articles,
+                              or None to disable the cache.
+            cache_ttl (float): Seconds after which cached entries expire.
+            api_key (str): Optional NCBI API key.
+        """
+        self.base_url = base_url.rstrip("/")
+        self.timeout = timeout
+        self.api_key = api_key
+        self.cache = DiskCache(cache_path, ttl=cache_ttl) if cache_path else None
+
+        retry = Retry(
+            total=retries,
+            backoff_factor=0.5,
+            status_forcelist=(429, 500, 502, 503, 504),
+            allowed_methods=("GET",),
+            respect_retry_after_header=True
+        )
+        self.session = requests.Session()
+        self.session.mount("http://", HTTPAdapter(max_retries=retry, pool_maxsize=config.PUBMED_POOL_SIZE))
+        self.session.mount("https://", HTTPAdapter(max_retries=retry, pool_maxsize=config.PUBMED_POOL_SIZE))
+
+        self._min_interval = 1.0 / requests_per_second if requests_per_second else 0.0
+        self._next_request = 0.0
+        self._throttle_lock = threading.Lock()
+
+    def _throttle(self):
+        with self._throttle_lock:
+            now = time.monotonic()
+            wait = self._next_request - now
+            self._next_request = max(now, self._next_request) + self._min_interval
+        if wait > 0:
+            time.sleep(wait)
+
+    def _get(self, endpoint: str, params: Dict[str, str]) -> ET.Element:
+        if self.api_key:
+            params = {**params, "api_key": self.api_key}
+        self._throttle()
+        resp = self.session.get(f"{self.base_url}/{endpoint}", params=params, timeout=self.timeout)
+        resp.raise_for_status()
+        return ET.fromstring(resp.text)
+
+    def search(self, query_text: str, max_results: int = 5) -> List[str]:
+        """Returns the PubMed IDs matching a query, from the cache when possible."""
+        key = make_key("esearch", normalize_query(query_text), max_results)
+        if self.cache is not None:
+            ids = self.cache.get(key)
+            CACHE_LOOKUPS.labels(cache="pubmed", result="miss" if ids is None else "hit").inc()
+            if ids is not None:
+                return ids
+
+        search_tree = self._get("esearch.fcgi", {
+            "db": "pubmed",
+            "term": query_text,
+            "retmode": "xml",
+            "retmax": max_results
+        })
+        ids = [id_elem.text for id_elem in search_tree.findall(".//Id")]
+
+        if self.cache is not None:
+            self.cache.put(key, ids)
+        return ids
+
+    def fetch(self, ids: List[str]) -> List[Dict[str, str]]:
+        """Returns the parsed articles of the given IDs, fetching only those not cached yet."""
+        articles = {}
+        if self.cache is not None:
+            for pubmed_id in ids:
+                article = self.cache.get(make_key("efetch", pubmed_id))
+                CACHE_LOOKUPS.labels(cache="pubmed", result="miss" if article is None else "hit").inc()
+                if article is not None:
+                    articles[pubmed_id] = article
+
+        missing = [pubmed_id for pubmed_id in ids if pubmed_id not in articles]
+        if missing:
+            fetch_tree = self._get("efetch.fcgi", {
+                "db": "pubmed",
+                "id": ",".join(missing),
+                "retmode": "xml"
+            })
+            for article_elem in fetch_tree.findall(".//PubmedArticle"):
+                pubmed_id = article_elem.find(".//PMID").text
+                article = parse_article(article_elem)
+                articles[pubmed_id] = article
+                if self.cache is not None:
+                    self.cache.put(make_key("efetch", pubmed_id), article)
+
+        return [articles[pubmed_id] for pubmed_id in ids if pubmed_id in articles]
+
+    def get_medical_studies(self, query_text: str, max_results: int = 5) -> List[Dict[str, str]]:
+        """
+        Searches PubMed and returns the matching articles.
+
+        Network and parsing errors are logged and yield an empty list, so a PubMed
+        outage does not fail the report.
+        """
+        try:
+            ids = self.search(query_text, max_results)
+            if not ids:
+                return []
+            return self.fetch(ids)
+        except (requests.RequestException, ET.ParseError) as e:
+            logger.warning("PubMed lookup failed: %s", e)
+            return []
+
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_pubmed_client() -> PubMedClient:
+    """Returns the PubMed client shared by the process."""
+    global _client
+    with _client_lock:
+        if _client is None:
+            _client = PubMedClient()
+    return _client
@@ -1,34 +1,92 @@
+import numpy as np
 import pandas as pd
 import torch
 
 from transformers import BlipForConditionalGeneration, BlipProcessor
 from PIL import Image
+import logging
 import os
 import re
 
+from batcher import MicroBatcher
+from cache import LRUCache, make_key
+from metrics import CACHE_LOOKUPS
+from imageLoader import DecodedImage
+from onnxBackend import BlipVisionEncoder, OnnxModel, check_backend, onnx_path
+from precision import apply_precision, input_dtype
+from streaming import CallbackStreamer
+from utils import image_digest, image_source, is_image_path
+
+logger = logging.getLogger(__name__)
+
 
 class ReportGenerator:
-    def __init__(self, model="nathansutton/generate-cxr", processor="nathansutton/generate-cxr", device='cuda'):
+    def __init__(self, model="nathansutton/generate-cxr", processor="nathansutton/generate-cxr", device='cuda',
+                 max_batch_size=8, max_wait_ms=10.0, cache=None, embedding_cache_bytes=256 * 1024 * 1024,
+                 precision="fp32", backend="torch"):
+        """
+        Loads the BLIP report generation model.
 
-        self.model = BlipForConditionalGeneration.from_pretrained(model).to(device)
-        self.processor = BlipProcessor.from_pretrained(processor)
+        Concurrent calls to `generate_report` are gathered by a micro-batcher and
+        decoded together in one `generate` call.
+
+        Args:
+            model (str): Name or path of the BLIP model.
+            processor (str): Name or path of the BLIP processor.
+            device (str): Device to run the model on.
+            max_batch_size (int): Maximum number of reports generated in one batch.
+            max_wait_ms (float): Maximum time a request waits for others to join its batch.
+            cache (InferenceCache): Optional cache of generated reports keyed by image
+                                    content, indication and view type.
+            embedding_cache_bytes (int): Size bound of the cache of vision encoder outputs.
+                                         A new indication for a cached image only runs
+                                         the text decoder. 0 disables it.
+            precision (str): "fp32", "bf16" or "int8", see `precision.apply_precision`.
+            backend (str): "torch", or "onnx" to run the vision encoder with ONNX Runtime.
+                           The text decoder always runs in torch.
+        """
+        check_backend(backend, precision)
+        self.model_name = model
+        self.cache = cache
+        self.embedding_cache = LRUCache(embedding_cache_bytes) if embedding_cache_bytes else None
 
         if not torch.cuda.is_available() and device == 'cuda':
-            print("Warning: CUDA is not available. Using CPU instead.")
+            logger.warning("CUDA is not available. Using CPU instead.")
             self.device = torch.device("cpu")
         else:
             self.device = device
 
+        self.precision = precision
+        self.model = BlipForConditionalGeneration.from_pretrained(model).to(self.device)
+        self.processor = BlipProcessor.from_pretrained(processor)
+
         self.model.eval() # Ensure the model is in evaluation mode
+        self.model = apply_precision(self.model, precision)
+
+        self.backend = backend
+        self.vision_encoder = BlipVisionEncoder(self.model.vision_model)
+        if backend == "onnx":
+            image_size = self.model.config.vision_config.image_size
+            self.vision_encoder = OnnxModel(
+                self.vision_encoder,
+                torch.zeros(1, 3, image_size, image_size),
+                onnx_path(f"{model}-vision")
+            )
+
+        self.batcher = MicroBatcher(self.generate_batch, max_batch_size=max_batch_size, max_wait_ms=max_wait_ms, name="blip")
 
-    def generate_report(self, image_path, indication, image_type="unknown"):
+    def generate_report(self, image_path, indication, image_type="unknown", on_text=None):
         """
         Generates a findings and impression report for a given image and indication.
 
         Args:
-            image_filename (str): Path to the image.
+            image_path (str, bytes, np.ndarray or DecodedImage): Path to the image, an encoded
+                                                   image buffer, or a decoded image.
             indication (str): The patient's indication.
             image_type (str): Type of image (e.g., "Frontal", "Lateral"). Used for logging.
+            on_text (callable): If given, called with the raw report text piece by piece
+                                while it is generated. Streamed reports bypass the
+                                micro-batcher. Cached reports are not streamed.
 
         Returns:
             tuple: A tuple containing the generated findings and impression.
@@ -38,25 +96,178 @@ class ReportGenerator:
         generated_findings = ""
         generated_impression = ""
 
-        try:
-            if os.path.exists(image_path):
-                img = Image.open(image_path).convert("RGB")
-                inputs = self.processor(images=img, text="indication: " + str(indication), return_tensors="pt").to(self.device)
-                output = self.model.generate(**inputs, max_length=100)
-                report_text = self.processor.decode(output[0], skip_special_tokens=True).strip()
-
-                find_match = re.search(r"findings\s*:\s*(.*?)\s*impression\s*:", report_text, re.IGNORECASE)
-                imp_match = re.search(r"impression\s*:\s*(.*)", report_text, re.IGNORECASE)
-
-                generated_findings = find_match.group(1).strip() if find_match else ""
-                generated_impression = imp_match.group(1).strip() if imp_match else ""
+        cache_key = None
+        if self.cache is not None:
+            digest = image_digest(image_path)
+            if digest is not None:
+                cache_key = make_key("blip", self.model_name, self.precision, digest, indication, image_type)
+                cached = self.cache.get(cache_key)
+                if cached is not None:
+                    return cached
 
+        try:
+            if isinstance(image_path, DecodedImage):
+                img = image_path.rgb()
+            elif isinstance(image_path, np.ndarray):
+                img = Image.fromarray(image_path).convert("RGB")
+            elif not is_image_path(image_path) or os.path.exists(image_path):
+                img = Image.open(image_source(image_path)).convert("RGB")
             else:
-                print(f"  {image_type} Image file not found: {image_path}")
+                logger.warning("%s image file not found: %s", image_type, image_path)
                 return "FILE_NOT_FOUND", "FILE_NOT_FOUND"
 
+            if on_text is None:
+                generated_findings, generated_impression = self.batcher((img, indication, image_digest(image_path)))
+            else:
+                generated_findings, generated_impression = self.generate_streaming(
+                    img, indication, image_digest(image_path), on_text
+                )
+
         except Exception as e:
-            print(f"  Error processing {image_type} image {image_path}: {e}")
+            image_name = image_path if is_image_path(image_path) else "in-memory image"
+            logger.exception("Error processing %s image %s: %s", image_type, image_name, e)
             return "ERROR", "ERROR"
 
-        return generated_findings, generated_impression
\ No newline at end of file
+        if cache_key is not None:
+            self.cache.put(cache_key, (generated_findings, generated_impression))
+
+        return generated_findings, generated_impression
+
+    def warmup(self):
+        """Generates a report for a blank image, bypassing the batcher and the caches."""
+        size = self.model.config.vision_config.image_size
+        self.generate_batch([(Image.new("RGB", (size, size)), "warm-up", None)])
+
+    def generate_batch(self, items):
+        """
+        Generates reports for a batch of (image, indication, digest) items.
+
+        The images are encoded once (or taken from the embedding cache), then the prompt
+        is decoded against them. The prompt is a prefix for the BLIP text decoder, which
+        overwrites its first token and drops its last one, so prompts of different token
+        lengths cannot be padded into the same prefix. Items are grouped by prompt length
+        and each group is decoded with a single padded `generate` call.
+
+        Args:
+            items (list): List of (PIL.Image, indication, digest) tuples. The digest
+                          identifies the image content in the embedding cache and may be None.
+
+        Returns:
+            list: A (findings, impression) tuple per item, in input order.
+        """
+        prompts = ["indication: " + str(indication) for _, indication, _ in items]
+        image_embeds = self.encode_images([image for image, _, _ in items], [digest for _, _, digest in items])
+
+        groups = {}
+        for i, input_ids in enumerate(self.processor.tokenizer(prompts)["input_ids"]):
+            groups.setdefault(len(input_ids), []).append(i)
+
+        results = [None] * len(items)
+        for indices in groups.values():
+            text_inputs = self.processor.tokenizer(
+                [prompts[i] for i in indices],
+                padding=True,
+                return_tensors="pt"
+            ).to(self.device)
+            output = self.decode(
+                torch.stack([image_embeds[i] for i in indices]),
+                text_inputs["input_ids"],
+                text_inputs["attention_mask"],
+                max_length=100
+            )
+            for i, sequence in zip(indices, output):
+                report_text = self.processor.decode(sequence, skip_special_tokens=True).strip()
+                results[i] = self.parse_report(report_text)
+
+        return results
+
+    def generate_streaming(self, image, indication, digest, on_text):
+        """
+        Generates the report of a single image, passing its text to `on_text` as it is decoded.
+
+        Returns:
+            tuple: The generated (findings, impression).
+        """
+        image_embeds = self.encode_images([image], [digest])
+        text_inputs = self.processor.tokenizer(["indication: " + str(indication)], return_tensors="pt").to(self.device)
+        output = self.decode(
+            torch.stack(image_embeds),
+            text_inputs["input_ids"],
+            text_inputs["attention_mask"],
+            max_length=100,
+            streamer=CallbackStreamer(self.processor.tokenizer, on_text, skip_special_tokens=True)
+        )
+        report_text = self.processor.decode(output[0], skip_special_tokens=True).strip()
+        return self.parse_report(report_text)
+
+    def encode_images(self, images, digests):
+        """
+        Runs the BLIP vision encoder on the images that are not in the embedding cache.
+
+        Args:
+            images (list): PIL images.
+            digests (list): Content digest per image, or None for images that should not be cached.
+
+        Returns:
+            list: One (tokens, hidden) embedding tensor per image.
+        """
+        keys = [make_key("blip-vision", self.model_name, self.precision, digest) if digest and self.embedding_cache is not None else None
+                for digest in digests]
+        embeds = [self.embedding_cache.get(key) if key else None for key in keys]
+        missing = [i for i, embed in enumerate(embeds) if embed is None]
+        if self.embedding_cache is not None:
+            CACHE_LOOKUPS.labels(cache="blip_embedding", result="hit").inc(len(images) - len(missing))
+            CACHE_LOOKUPS.labels(cache="blip_embedding", result="miss").inc(len(missing))
+
+        if missing:
+            pixel_values = self.processor(images=[images[i] for i in missing], return_tensors="pt")["pixel_values"]
+            pixel_values = pixel_values.to(self.device, dtype=input_dtype(self.precision))
+            with torch.no_grad():
+                encoded = self.vision_encoder(pixel_values).to(self.device)
+            for i, embed in zip(missing, encoded):
+                embeds[i] = embed
+                if keys[i]:
+                    self.embedding_cache.put(keys[i], embed, size=embed.element_size() * embed.nelement())
+
+        return embeds
+
+    def decode(self, image_embeds, input_ids, attention_mask, **generate_kwargs):
+        """
+        Generates text from precomputed image embeddings.
+
+        Mirrors `BlipForConditionalGeneration.generate` without its vision encoder pass.
+
+        Args:
+            image_embeds (torch.Tensor): Vision encoder outputs of shape (N, tokens, hidden).
+            input_ids (torch.Tensor): Tokenized prompts, including [CLS] and [SEP].
+            attention_mask (torch.Tensor): Attention mask of the prompts.
+
+        Returns:
+            torch.Tensor: Generated token ids, prompt included.
+        """
+        text_config = self.model.config.text_config
+        image_attention_mask = torch.ones(image_embeds.size()[:-1], dtype=torch.long, device=image_embeds.device)
+
+        input_ids = input_ids.clone()
+        input_ids[:, 0] = text_config.bos_token_id
+
+        with torch.no_grad():
+            return self.model.text_decoder.generate(
+                input_ids=input_ids[:, :-1],
+                eos_token_id=text_config.sep_token_id,
+                pad_token_id=text_config.pad_token_id,
+                attention_mask=attention_mask[:, :-1],
+                encoder_hidden_states=image_embeds,
+                encoder_attention_mask=image_attention_mask,
+                **generate_kwargs
+            )
+
+    @staticmethod
+    def parse_report(report_text):
+        """Splits a generated report into its findings and impression sections."""
+        find_match = re.search(r"findings\s*:\s*(.*?)\s*impression\s*:", report_text, re.IGNORECASE)
+        imp_match = re.search(r"impression\s*:\s*(.*)", report_text, re.IGNORECASE)
+
+        generated_findings = find_match.group(1).strip() if find_match else ""
+        generated_impression = imp_match.group(1).strip() if imp_match else ""
+        return generated_findings, generated_impression
@@ -0,0 +1,183 @@
+# Multi-process serving with model weights shared between the workers.
+#
+# The models are loaded once in this parent process, then N inference workers are forked.
+# The workers share the weights copy-on-write, since inference never writes to them, so
+# memory does not grow with the number of workers. Every worker runs its own uvicorn server
+# on the listening socket inherited from the parent, with its own torch thread count and
+# CPU affinity.
+#
+# Run it from backend/src with:
+#   python serve.py --workers 4 --port 8000
+
+import argparse
+import gc
+import logging
+import os
+import signal
+import socket
+import sys
+import tempfile
+import time
+
+# Models are loaded synchronously below, before forking, instead of by background threads
+os.environ["MODEL_LOADING"] = "lazy"
+
+# Workers write their metrics to files that /metrics aggregates, so a scrape served by any
+# worker covers all of them. This has to happen before prometheus_client is imported.
+if os.environ.get("PROMETHEUS_MULTIPROC_DIR"):
+    # Metrics files of an earlier run would be added to this one's
+    os.makedirs(os.environ["PROMETHEUS_MULTIPROC_DIR"], exist_ok=True)
+    for name in os.listdir(os.environ["PROMETHEUS_MULTIPROC_DIR"]):
+        if name.endswith(".db"):
+            os.remove(os.path.join(os.environ["PROMETHEUS_MULTIPROC_DIR"], name))
+else:
+    os.environ["PROMETHEUS_MULTIPROC_DIR"] = tempfile.mkdtemp(prefix="args-metrics-")
+
+import torch
+import uvicorn
+
+import main
+from logs import stop_logging
+from metrics import mark_process_dead
+
+logger = logging.getLogger("serve")
+
+# A worker that exits sooner than this after starting counts as a failed start
+MIN_UPTIME_SECONDS = 30.0
+# Restart delays double with each consecutive failed start, up to the maximum
+MAX_RESTART_DELAY_SECONDS = 60.0
+# Consecutive failed starts of a worker after which the server gives up
+MAX_FAST_FAILURES = 5
+
+
+def available_cpus():
+    """Returns the CPUs this process may run on."""
+    return sorted(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else list(range(os.cpu_count() or 1))
+
+
+def split_cpus(workers: int):
+    """Splits the CPUs available to this process into one disjoint set per worker."""
+    cpus = available_cpus()
+    per_worker = max(1, len(cpus) // workers)
+    return [cpus[i * per_worker:(i + 1) * per_worker] or cpus for i in range(workers)]
+
+
+def run_worker(sock: socket.socket, cpus, threads: int, args):
+    """Body of a forked worker process: pins it, warms the models up and serves requests."""
+    if cpus and hasattr(os, "sched_setaffinity"):
+        os.sched_setaffinity(0, cpus)
+    # Without affinity, a worker may use every CPU available to the server
+    torch.set_num_threads(threads or len(cpus or available_cpus()))
+
+    # Warm-up runs here, not in the parent, so the parent never starts a torch thread pool.
+    # ONNX Runtime sessions are likewise created here, with the thread count set above
+    main.registry.warm_up()
+
+    server = uvicorn.Server(uvicorn.Config(main.app, log_level=args.log_level))
+    server.run(sockets=[sock])
+
+
+def serve():
+    parser = argparse.ArgumentParser(description="Serve the backend with several forked workers sharing the models.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--workers", type=int, default=2, help="Number of inference worker processes.")
+    parser.add_argument("--threads-per-worker", type=int, default=0,
+                        help="torch intra-op threads per worker (0 uses the worker's CPU count).")
+    parser.add_argument("--no-affinity", action="store_true", help="Do not pin workers to disjoint CPU sets.")
+    parser.add_argument("--log-level", default="info")
+    args = parser.parse_args()
+
+    # A single thread while loading keeps torch from creating a thread pool before the fork
+    torch.set_num_threads(1)
+    main.registry.start(wait=True, warmup=False)
+
+    # Move everything allocated so far out of the garbage collector's reach, so collections
+    # in the workers do not write to, and thereby copy, the pages shared with the parent
+    gc.freeze()
+
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((args.host, args.port))
+    sock.listen(2048)
+    sock.set_inheritable(True)
+
+    cpu_sets = split_cpus(args.workers)
+    children = {}
+    started_at = {}
+    fast_failures = [0] * args.workers
+    shutting_down = False
+    exit_code = 0
+
+    def spawn(index):
+        started_at[index] = time.monotonic()
+        pid = os.fork()
+        if pid == 0:
+            signal.signal(signal.SIGTERM, signal.SIG_DFL)
+            signal.signal(signal.SIGINT, signal.SIG_DFL)
+            cpus = [] if args.no_affinity else cpu_sets[index]
+            code = 1
+            try:
+                run_worker(sock, cpus, args.threads_per_worker, args)
+                code = 0
+            except BaseException:
+                logger.exception("Worker %d failed", index)
+            finally:
+                # os._exit skips atexit hooks, so write out the queued log records first
+                stop_logging()
+                os._exit(code)
+        children[pid] = index
+        logger.info("Started worker %d (pid %d)", index, pid)
+
+    def shutdown(signum, _frame):
+        nonlocal shutting_down
+        shutting_down = True
+        for pid in children:
+            os.kill(pid, signum)
+
+    signal.signal(signal.SIGTERM, shutdown)
+    signal.signal(signal.SIGINT, shutdown)
+
+    for index in range(args.workers):
+        spawn(index)
+
+    # Supervise the workers, replacing any that die unexpectedly
+    while children:
+        try:
+            pid, status = os.wait()
+        except ChildProcessError:
+            break
+        except InterruptedError:
+            continue
+        index = children.pop(pid, None)
+        mark_process_dead(pid)
+        if index is None or shutting_down:
+            continue
+
+        # Back off exponentially while a worker keeps failing right after it starts, e.g.
+        # because of a bad configuration, instead of forking it again in a tight loop
+        if time.monotonic() - started_at[index] < MIN_UPTIME_SECONDS:
+            fast_failures[index] += 1
+        else:
+            fast_failures[index] = 0
+        if fast_failures[index] >= MAX_FAST_FAILURES:
+            logger.error("Worker %d failed %d times in a row right after starting, shutting down",
+                         index, fast_failures[index])
+            exit_code = 1
+            shutdown(signal.SIGTERM, None)
+            continue
+
+        delay = min(MAX_RESTART_DELAY_SECONDS, 2.0 ** fast_failures[index] - 1)
+        logger.warning("Worker %d (pid %d) exited with status %d, restarting it in %.0f s", index, pid, status, delay)
+        deadline = time.monotonic() + delay
+        while not shutting_down and time.monotonic() < deadline:
+            time.sleep(max(0.0, min(0.5, deadline - time.monotonic())))
+        if not shutting_down:
+            spawn(index)
+
+    sock.close()
+    sys.exit(exit_code)
+
+
+if __name__ == "__main__":
+    serve()
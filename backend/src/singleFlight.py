@@ -0,0 +1,56 @@
+import threading
+from concurrent.futures import Future
+from typing import Callable, Dict, Optional, Tuple
+
+
+class SingleFlight:
+    def __init__(self):
+        """
+        Coalesces identical work that is in flight at the same time.
+
+        The first caller for a key starts the work. Callers arriving with the same key
+        before it finishes share the first caller's future instead of starting it again.
+        Finished work is forgotten, so this is not a cache.
+        """
+        self._futures: Dict[str, Future] = {}
+        self._lock = threading.Lock()
+        self.leaders = 0
+        self.followers = 0
+
+    def submit(self, key: str, start: Callable[[], Optional[Future]]) -> Tuple[Optional[Future], bool]:
+        """
+        Returns the future of the work for `key`, starting it if none is in flight.
+
+        Args:
+            key (str): Identifies the work.
+            start (callable): Starts the work and returns its future, or None if it could
+                              not be started (e.g. the executor is full).
+
+        Returns:
+            tuple: (future, leader), where leader is True if this call started the work.
+                   The future is None if `start` returned None.
+        """
+        with self._lock:
+            future = self._futures.get(key)
+            if future is not None:
+                self.followers += 1
+                return future, False
+
+            future = start()
+            if future is None:
+                return None, True
+            self._futures[key] = future
+            self.leaders += 1
+
+        future.add_done_callback(lambda _: self._forget(key, future))
+        return future, True
+
+    def _forget(self, key: str, future: Future):
+        with self._lock:
+            if self._futures.get(key) is future:
+                del self._futures[key]
+
+    def stats(self) -> Dict[str, int]:
+        """Returns how many calls started work and how many joined work in flight."""
+        with self._lock:
+            return {"leaders": self.leaders, "followers": self.followers, "in_flight": len(self._futures)}
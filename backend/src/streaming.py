@@ -0,0 +1,25 @@
+from typing import Callable
+
+from transformers import TextStreamer
+
+
+class CallbackStreamer(TextStreamer):
+    def __init__(self, tokenizer, on_text: Callable[[str], None], skip_prompt: bool = True, **decode_kwargs):
+        """
+        Passes generated text to a callback while `generate` is still running.
+
+        Text is handed over in whole words, as `TextStreamer` finalizes it. Streaming
+        only works for a batch of one sequence.
+
+        Args:
+            tokenizer: Tokenizer used to decode the generated tokens.
+            on_text (callable): Called with each new piece of text.
+            skip_prompt (bool): Do not pass on the prompt given to `generate`.
+            decode_kwargs: Passed to `tokenizer.decode`, e.g. skip_special_tokens=True.
+        """
+        super().__init__(tokenizer, skip_prompt=skip_prompt, **decode_kwargs)
+        self.on_text = on_text
+
+    def on_finalized_text(self, text: str, stream_end: bool = False):
+        if text:
+            self.on_text(text)
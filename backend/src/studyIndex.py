@@ -0,0 +1,235 @@
+# Local semantic index over PubMed abstracts, used instead of live PubMed lookups.
+#
+# Build an index from PubMed XML dumps (plain or gzipped):
+#   python studyIndex.py build --out assets/study_index pubmed25n0001.xml.gz pubmed25n0002.xml.gz
+# Query it:
+#   python studyIndex.py query --index assets/study_index "right lower lobe consolidation"
+# Serve it by setting STUDY_INDEX_DIR=assets/study_index for the backend.
+
+import argparse
+import gzip
+import json
+import os
+import xml.etree.ElementTree as ET
+from typing import Dict, Iterator, List, Optional
+
+import numpy as np
+import torch
+from transformers import AutoModel, AutoTokenizer
+
+import config
+from pubmed import parse_article
+
+
+class TextEmbedder:
+    def __init__(self, model_name: str = config.STUDY_INDEX_EMBEDDING_MODEL, max_length: int = 256):
+        """
+        Embeds text with a Hugging Face encoder by mean pooling its last hidden state.
+
+        Args:
+            model_name (str): Name or path of the encoder model.
+            max_length (int): Maximum number of tokens per text.
+        """
+        self.model_name = model_name
+        self.max_length = max_length
+        self.tokenizer = AutoTokenizer.from_pretrained(model_name)
+        self.model = AutoModel.from_pretrained(model_name)
+        self.model.eval()
+
+    def embed(self, texts: List[str]) -> np.ndarray:
+        """Returns L2-normalized float32 embeddings of shape (len(texts), dim)."""
+        inputs = self.tokenizer(texts, padding=True, truncation=True, max_length=self.max_length, return_tensors="pt")
+        with torch.no_grad():
+            hidden = self.model(**inputs).last_hidden_state
+        mask = inputs["attention_mask"].unsqueeze(-1).to(hidden.dtype)
+        pooled = (hidden * mask).sum(dim=1) / mask.sum(dim=1).clamp(min=1e-9)
+        pooled = torch.nn.functional.normalize(pooled, dim=-1)
+        return pooled.cpu().numpy().astype(np.float32)
+
+
+def iter_pubmed_xml(paths: List[str]) -> Iterator[Dict[str, str]]:
+    """Streams parsed articles out of PubMed XML dumps without loading whole files."""
+    for path in paths:
+        opener = gzip.open if path.endswith(".gz") else open
+        with opener(path, "rb") as f:
+            for _, elem in ET.iterparse(f, events=("end",)):
+                if elem.tag != "PubmedArticle":
+                    continue
+                if elem.find(".//PMID") is not None:
+                    yield parse_article(elem)
+                elem.clear()
+
+
+def _kmeans(vectors: np.ndarray, n_lists: int, iterations: int = 20, seed: int = 0) -> np.ndarray:
+    """Spherical k-means on unit vectors. Returns normalized centroids of shape (n_lists, dim)."""
+    rng = np.random.default_rng(seed)
+    centroids = vectors[rng.choice(len(vectors), size=n_lists, replace=False)].copy()
+    for _ in range(iterations):
+        assignments = np.argmax(vectors @ centroids.T, axis=1)
+        for k in range(n_lists):
+            members = vectors[assignments == k]
+            if len(members):
+                centroids[k] = members.sum(axis=0)
+        centroids /= np.linalg.norm(centroids, axis=1, keepdims=True).clip(min=1e-12)
+    return centroids
+
+
+def build_index(xml_paths: List[str], out_dir: str, embedder: TextEmbedder, batch_size: int = 64,
+                n_lists: int = 0, sample_size: int = 50000) -> int:
+    """
+    Builds an index directory from PubMed XML dumps.
+
+    The directory holds the article records as JSON lines with their byte offsets, the
+    embedding matrix as a .npy file that is memory-mapped at query time, and optionally
+    an inverted-file (IVF) partition of the embeddings for approximate search.
+
+    Args:
+        xml_paths (list): PubMed XML dump files.
+        out_dir (str): Output directory.
+        embedder (TextEmbedder): Embedder of the article texts.
+        batch_size (int): Number of articles embedded at once.
+        n_lists (int): Number of IVF lists, or 0 to only support exact search.
+        sample_size (int): Number of embeddings the IVF centroids are trained on.
+
+    Returns:
+        int: Number of indexed articles.
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    articles_path = os.path.join(out_dir, "articles.jsonl")
+
+    # Pass 1: store the article records and remember where each one starts
+    offsets = []
+    with open(articles_path, "wb") as f:
+        for article in iter_pubmed_xml(xml_paths):
+            offsets.append(f.tell())
+            f.write(json.dumps(article).encode("utf-8") + b"\n")
+    np.save(os.path.join(out_dir, "offsets.npy"), np.asarray(offsets, dtype=np.int64))
+
+    count = len(offsets)
+    if count == 0:
+        raise ValueError("No articles found in the given XML files.")
+
+    # Pass 2: embed them into a memory-mapped matrix
+    embeddings = None
+    with open(articles_path, "rb") as f:
+        row = 0
+        while row < count:
+            batch = [json.loads(f.readline()) for _ in range(min(batch_size, count - row))]
+            vectors = embedder.embed([f"{a['title']}. {a['abstract']}" for a in batch])
+            if embeddings is None:
+                embeddings = np.lib.format.open_memmap(
+                    os.path.join(out_dir, "embeddings.npy"), mode="w+", dtype=np.float32, shape=(count, vectors.shape[1])
+                )
+            embeddings[row:row + len(batch)] = vectors
+            row += len(batch)
+    embeddings.flush()
+
+    if n_lists:
+        rng = np.random.default_rng(0)
+        sample = embeddings[np.sort(rng.choice(count, size=min(sample_size, count), replace=False))]
+        centroids = _kmeans(np.asarray(sample), min(n_lists, len(sample)))
+        assignments = np.concatenate([
+            np.argmax(embeddings[start:start + 65536] @ centroids.T, axis=1)
+            for start in range(0, count, 65536)
+        ])
+        order = np.argsort(assignments, kind="stable")
+        list_offsets = np.searchsorted(assignments[order], np.arange(len(centroids) + 1))
+        np.save(os.path.join(out_dir, "ivf_centroids.npy"), centroids)
+        np.save(os.path.join(out_dir, "ivf_order.npy"), order.astype(np.int64))
+        np.save(os.path.join(out_dir, "ivf_offsets.npy"), list_offsets.astype(np.int64))
+
+    with open(os.path.join(out_dir, "meta.json"), "w") as f:
+        json.dump({"model": embedder.model_name, "count": count, "dim": int(embeddings.shape[1]), "ivf_lists": n_lists}, f)
+
+    return count
+
+
+class StudyIndex:
+    def __init__(self, index_dir: str, embedder: Optional[TextEmbedder] = None, nprobe: int = config.STUDY_INDEX_NPROBE):
+        """
+        Answers study queries from an index built by `build_index`, without network access.
+
+        Args:
+            index_dir (str): Directory of the index.
+            embedder (TextEmbedder): Query embedder. Defaults to the model the index was built with.
+            nprobe (int): Number of IVF lists searched per query, if the index has them.
+        """
+        with open(os.path.join(index_dir, "meta.json")) as f:
+            self.meta = json.load(f)
+        self.embedder = embedder or TextEmbedder(self.meta["model"])
+        self.embeddings = np.load(os.path.join(index_dir, "embeddings.npy"), mmap_mode="r")
+        self.offsets = np.load(os.path.join(index_dir, "offsets.npy"))
+        self.articles_path = os.path.join(index_dir, "articles.jsonl")
+        self.nprobe = nprobe
+
+        self.centroids = None
+        if self.meta.get("ivf_lists"):
+            self.centroids = np.load(os.path.join(index_dir, "ivf_centroids.npy"))
+            self.ivf_order = np.load(os.path.join(index_dir, "ivf_order.npy"), mmap_mode="r")
+            self.ivf_offsets = np.load(os.path.join(index_dir, "ivf_offsets.npy"))
+
+    def _candidates(self, query_vector: np.ndarray) -> Optional[np.ndarray]:
+        if self.centroids is None or self.nprobe >= len(self.centroids):
+            return None
+        probes = np.argsort(self.centroids @ query_vector)[-self.nprobe:]
+        return np.sort(np.concatenate([
+            self.ivf_order[self.ivf_offsets[k]:self.ivf_offsets[k + 1]] for k in probes
+        ]))
+
+    def _article(self, row: int) -> Dict[str, str]:
+        with open(self.articles_path, "rb") as f:
+            f.seek(int(self.offsets[row]))
+            return json.loads(f.readline())
+
+    def search_rows(self, query_vector: np.ndarray, max_results: int = 5):
+        """Returns (rows, cosine similarities) of the best matches, best first."""
+        rows = self._candidates(query_vector)
+        matrix = self.embeddings if rows is None else self.embeddings[rows]
+        scores = matrix @ query_vector
+
+        k = min(max_results, len(scores))
+        if k <= 0:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return (top if rows is None else rows[top]), scores[top]
+
+    def search(self, query_text: str, max_results: int = 5) -> List[Dict[str, str]]:
+        """
+        Finds the articles most similar to the query text.
+
+        Returns:
+            List[Dict[str, str]]: Articles with title, authors, abstract and link, like `get_medical_studies`.
+        """
+        query_vector = self.embedder.embed([query_text])[0]
+        rows, _ = self.search_rows(query_vector, max_results)
+        return [self._article(row) for row in rows]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build or query the local study index.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    build = subparsers.add_parser("build", help="Build an index from PubMed XML dumps.")
+    build.add_argument("xml", nargs="+", help="PubMed XML dump files (.xml or .xml.gz).")
+    build.add_argument("--out", required=True, help="Output index directory.")
+    build.add_argument("--model", default=config.STUDY_INDEX_EMBEDDING_MODEL, help="Embedding model.")
+    build.add_argument("--batch-size", type=int, default=64)
+    build.add_argument("--ivf-lists", type=int, default=0, help="Number of IVF lists for approximate search (0 = exact only).")
+
+    query = subparsers.add_parser("query", help="Query an index.")
+    query.add_argument("text", help="Query text.")
+    query.add_argument("--index", required=True, help="Index directory.")
+    query.add_argument("-k", type=int, default=5, help="Number of results.")
+
+    args = parser.parse_args()
+    if args.command == "build":
+        count = build_index(args.xml, args.out, TextEmbedder(args.model), batch_size=args.batch_size, n_lists=args.ivf_lists)
+        print(f"Indexed {count} articles into {args.out}")
+    else:
+        for article in StudyIndex(args.index).search(args.text, max_results=args.k):
+            print(f"{article['title']}\n  {article['link']}")
+
+
+if __name__ == "__main__":
+    main()
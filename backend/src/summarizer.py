@@ -1,16 +1,65 @@
+import re
+from collections import Counter
+
 import torch
 from transformers import pipeline
 
+from precision import apply_precision, check_precision
+from streaming import CallbackStreamer
+
+# Tiers reported by summarize_tiered
+TIER_EMPTY = "empty"
+TIER_PASSTHROUGH = "passthrough"
+TIER_EXTRACTIVE = "extractive"
+TIER_ABSTRACTIVE = "abstractive"
+
 class ClinicalTextSummarizer:
-    def __init__(self, model_name="sshleifer/distilbart-cnn-12-6"):
+    def __init__(self, model_name="sshleifer/distilbart-cnn-12-6", decoding="sample", batch_size=8, length_bucket=64,
+                 limit_bucket=32, tiered=False, abstractive_budget=150, precision="fp32"):
         """
         Initializes the ClinicalTextSummarizer with a Hugging Face model.
 
         Args:
             model_name (str): The name of the pre-trained model to use.
-                              Defaults to "microsoft/BiomedNLP-PubMedBERT-base-abstract-uncased".
+                              Defaults to "sshleifer/distilbart-cnn-12-6".
+            decoding (str): "sample" to sample summaries, or "greedy" for deterministic
+                            greedy decoding.
+            batch_size (int): Maximum number of texts summarized in one forward pass.
+            length_bucket (int): Width, in words, of the input length buckets used by
+                                 `summarize_batch`. Only texts in the same bucket share a
+                                 padded batch.
+            limit_bucket (int): Width, in tokens, of the max_length buckets. Jobs whose
+                                max_length falls in the same bucket share a pipeline call,
+                                so a study's findings and impression are summarized together.
+            tiered (bool): Only run the model when needed. Texts that already fit in
+                           max_length words pass through unchanged, texts of up to
+                           `abstractive_budget` words are summarized extractively.
+            abstractive_budget (int): Word count above which tiered mode uses the model.
+            precision (str): "fp32", "bf16" or "int8", see `precision.apply_precision`.
         """
-        self.summarizer = pipeline("summarization", model="sshleifer/distilbart-cnn-12-6", device=0 if torch.cuda.is_available() else -1) # Use GPU if available
+        if decoding not in ("sample", "greedy"):
+            raise ValueError(f"Unknown decoding mode '{decoding}', expected 'sample' or 'greedy'.")
+        check_precision(precision)
+        self.summarizer = pipeline(
+            "summarization",
+            model=model_name,
+            device=0 if torch.cuda.is_available() else -1, # Use GPU if available
+            torch_dtype=torch.bfloat16 if precision == "bf16" else None
+        )
+        if precision == "int8":
+            self.summarizer.model = apply_precision(self.summarizer.model, precision)
+        self.decoding = decoding
+        self.batch_size = batch_size
+        self.length_bucket = max(1, length_bucket)
+        self.limit_bucket = max(1, limit_bucket)
+        self.tiered = tiered
+        self.abstractive_budget = abstractive_budget
+
+    def generation_kwargs(self):
+        """Returns the generate arguments of the configured decoding mode."""
+        if self.decoding == "greedy":
+            return {"do_sample": False, "num_beams": 1}
+        return {"do_sample": True}
 
     def summarize(self, text, min_length=0, max_length=80):
         """
@@ -24,8 +73,180 @@ class ClinicalTextSummarizer:
         Returns:
             str: The summarized text.
         """
+        return self.summarize_batch([(text, min_length, max_length)])[0]
+
+    def summarize_batch(self, jobs):
+        """
+        Summarizes many texts, see `summarize_tiered`.
+
+        Args:
+            jobs (list): List of (text, min_length, max_length) tuples.
+
+        Returns:
+            list: The summary of each job, in input order.
+        """
+        return [summary for summary, _ in self.summarize_tiered(jobs)]
+
+    def choose_tier(self, text, max_length):
+        """Returns the tier a text is summarized with."""
         if not text:
-            return ""
-        # Hugging Face pipeline expects a list of strings
-        summary = self.summarizer(text, min_length=min_length, max_length=max_length, do_sample=True)[0]['summary_text']
-        return summary
\ No newline at end of file
+            return TIER_EMPTY
+        if not self.tiered:
+            return TIER_ABSTRACTIVE
+        word_count = len(text.split())
+        if word_count <= max_length:
+            return TIER_PASSTHROUGH
+        if word_count <= self.abstractive_budget:
+            return TIER_EXTRACTIVE
+        return TIER_ABSTRACTIVE
+
+    def summarize_tiered(self, jobs):
+        """
+        Summarizes many texts, using the model only for the jobs whose tier requires it.
+
+        Args:
+            jobs (list): List of (text, min_length, max_length) tuples.
+
+        Returns:
+            list: A (summary, tier) tuple per job, in input order.
+        """
+        results = [None] * len(jobs)
+        abstractive = []
+        for i, (text, _, max_length) in enumerate(jobs):
+            tier = self.choose_tier(text, max_length)
+            if tier == TIER_EMPTY:
+                results[i] = ("", tier)
+            elif tier == TIER_PASSTHROUGH:
+                results[i] = (self.clean(text), tier)
+            elif tier == TIER_EXTRACTIVE:
+                results[i] = (self.extract(text, max_length), tier)
+            else:
+                abstractive.append(i)
+
+        summaries = self.summarize_with_model([jobs[i] for i in abstractive])
+        for i, summary in zip(abstractive, summaries):
+            results[i] = (summary, TIER_ABSTRACTIVE)
+
+        return results
+
+    def summarize_stream(self, text, min_length=0, max_length=80, on_text=None):
+        """
+        Summarizes a single text like `summarize_tiered`, streaming the summary.
+
+        Model summaries are passed to `on_text` piece by piece while they are generated.
+        Summaries of the other tiers are passed on in one piece.
+
+        Args:
+            text (str): The clinical text to summarize.
+            min_length (int): Minimum length of the summary.
+            max_length (int): Maximum length of the summary.
+            on_text (callable): Called with each new piece of the summary.
+
+        Returns:
+            tuple: The (summary, tier).
+        """
+        if on_text is None or self.choose_tier(text, max_length) != TIER_ABSTRACTIVE:
+            summary, tier = self.summarize_tiered([(text, min_length, max_length)])[0]
+            if on_text is not None and summary:
+                on_text(summary)
+            return summary, tier
+
+        output = self.summarizer(
+            text,
+            min_length=min_length,
+            max_length=max_length,
+            streamer=CallbackStreamer(self.summarizer.tokenizer, on_text, skip_special_tokens=True),
+            **self.generation_kwargs()
+        )
+        return output[0]['summary_text'], TIER_ABSTRACTIVE
+
+    @staticmethod
+    def clean(text):
+        """Normalizes whitespace and doubled periods of combined report text."""
+        return re.sub(r"\.(\s*\.)+", ".", " ".join(text.split()))
+
+    def extract(self, text, max_length):
+        """
+        Extractive summary: keeps the highest scoring sentences, in their original order,
+        within max_length words. Sentences are scored by the average corpus frequency of
+        their words, and repeated sentences (e.g. the same finding in both views) are kept once.
+        """
+        sentences = []
+        for sentence in re.split(r"(?<=[.!?])\s+|\n+", self.clean(text)):
+            sentence = sentence.strip()
+            if sentence and sentence.lower() not in (s.lower() for s in sentences):
+                sentences.append(sentence)
+
+        frequencies = Counter(word for word in re.findall(r"\w+", text.lower()))
+        def score(sentence):
+            words = re.findall(r"\w+", sentence.lower())
+            return sum(frequencies[word] for word in words) / len(words) if words else 0.0
+
+        selected = set()
+        budget = max_length
+        for i in sorted(range(len(sentences)), key=lambda i: score(sentences[i]), reverse=True):
+            length = len(sentences[i].split())
+            if length <= budget:
+                selected.add(i)
+                budget -= length
+
+        if not selected and sentences:
+            # Even the best sentence is too long, keep its first max_length words
+            best = max(sentences, key=score)
+            return " ".join(best.split()[:max_length])
+
+        return " ".join(sentences[i] for i in sorted(selected))
+
+    def warmup(self):
+        """Summarizes a short synthetic text with the model."""
+        self.summarize_with_model([("The lungs are clear. There is no pleural effusion or pneumothorax.", 5, 20)])
+
+    def summarize_with_model(self, jobs):
+        """
+        Summarizes texts with the model, batching texts of similar length together.
+
+        Jobs are grouped by max_length bucket (`limit_bucket` tokens) and input length
+        bucket (`length_bucket` words), and texts are sorted by length within a group so
+        each padded batch holds texts of similar size. A group whose jobs all have the same
+        limits runs with them. A mixed group runs with its widest limits, and each summary
+        is then trimmed to its own max_length. Such a summary may be shorter than its own
+        min_length.
+
+        Args:
+            jobs (list): List of (text, min_length, max_length) tuples.
+
+        Returns:
+            list: The summary of each job, in input order. Empty texts give empty summaries.
+        """
+        results = [""] * len(jobs)
+
+        buckets = {}
+        for i, (text, _, max_length) in enumerate(jobs):
+            if not text:
+                continue
+            bucket = (max_length // self.limit_bucket, len(text.split()) // self.length_bucket)
+            buckets.setdefault(bucket, []).append(i)
+
+        for indices in buckets.values():
+            indices.sort(key=lambda i: len(jobs[i][0]))
+            limits = {(jobs[i][1], jobs[i][2]) for i in indices}
+            outputs = self.summarizer(
+                [jobs[i][0] for i in indices],
+                min_length=min(min_length for min_length, _ in limits),
+                max_length=max(max_length for _, max_length in limits),
+                batch_size=self.batch_size,
+                **self.generation_kwargs()
+            )
+            for i, output in zip(indices, outputs):
+                summary = output['summary_text']
+                results[i] = self.trim(summary, jobs[i][2]) if len(limits) > 1 else summary
+
+        return results
+
+    def trim(self, summary, max_length):
+        """Cuts a summary to at most `max_length` tokens of the summarizer's tokenizer."""
+        tokenizer = self.summarizer.tokenizer
+        ids = tokenizer(summary, add_special_tokens=False)["input_ids"]
+        if len(ids) <= max_length:
+            return summary
+        return tokenizer.decode(ids[:max_length], skip_special_tokens=True).strip()
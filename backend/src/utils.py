@@ -1,9 +1,15 @@
+import hashlib
+import io
 import os
 import re
-import requests
 import numpy as np
-import xml.etree.ElementTree as ET
-from typing import List, Dict, Optional
+from typing import List, Dict, Optional, Union
+
+from pathology import DEFAULT_THRESHOLD, PathologyScores, Thresholds
+from pubmed import get_pubmed_client
+
+# An image is either a file path, an encoded buffer or a decoded pixel array
+ImageInput = Union[str, bytes, bytearray, memoryview, np.ndarray]
 
 
 def get_summary_params(fron_text:str, lat_text:str, chex_text:str) -> Dict[str, int]:
@@ -47,70 +53,101 @@ def replace_indication_placeholder(text: str, substitute:str) -> str:
   """
   return re.sub(r'XXXX', substitute, str(text), flags=re.IGNORECASE)
 
-def aggregate_chexpert_predictions(chex_preds_list: List[Dict[str, float]]) -> Dict[str, float]:
+def aggregate_chexpert_predictions(chex_preds: PathologyScores) -> PathologyScores:
+    """
+    Aggregates the CheXpert predictions of several images by averaging the scores of each pathology.
+
+    Args:
+        chex_preds (PathologyScores): Scores of the images, one row each.
+
+    Returns:
+        PathologyScores: A single row of averaged scores. NaN scores are ignored; pathologies
+                         without any valid score stay NaN.
+    """
+    return chex_preds.mean()
+
+def chexpert_preds_to_text(predictions: PathologyScores, threshold: Thresholds = DEFAULT_THRESHOLD) -> str:
     """
-    Aggregates a list of CheXpert prediction dictionaries by averaging the scores for each pathology.
+    Converts CheXpert probability predictions to text findings based on thresholds.
 
     Args:
-        chex_preds_list (list): A list of dictionaries, where each dictionary
-                                 contains pathology names as keys and prediction scores as values.
+        predictions (PathologyScores): A single row of scores.
+        threshold (float or dict): Threshold of every pathology, or per-pathology thresholds.
 
     Returns:
-        dict: A dictionary with aggregated (averaged) scores for each pathology.
-              Returns an empty dictionary if the input list is empty or None.
+        str: The pathologies at or above their threshold, e.g. "effusion, edema and pneumonia".
+    """
+    findings = [pathology.replace('_', ' ').lower() for pathology in predictions.above(threshold)[0]]
+    if len(findings) <= 1:
+        return "".join(findings)
+    return ", ".join(findings[:-1]) + " and " + findings[-1]
+
+def is_image_path(image) -> bool:
+    """Returns True if the image is given as a file path rather than an in-memory buffer."""
+    return isinstance(image, (str, os.PathLike))
+
+def image_source(image):
     """
-    if not chex_preds_list:
-        return {}
-
-    # Initialize a dictionary to store the sum of scores for each pathology
-    sum_of_scores = {}
-    # Initialize a dictionary to store the count of valid scores for each pathology
-    count_of_scores = {}
-
-    for predictions in chex_preds_list:
-        for pathology, score in predictions.items():
-            if pathology not in sum_of_scores:
-                sum_of_scores[pathology] = 0.0
-                count_of_scores[pathology] = 0
-
-            # Only add if the score is a valid number (not None, NaN, etc.)
-            if isinstance(score, (int, float)) and not np.isnan(score):
-                 sum_of_scores[pathology] += score
-                 count_of_scores[pathology] += 1
-
-    # Calculate the average score for each pathology
-    aggregated_predictions = {}
-    for pathology, total_score in sum_of_scores.items():
-        if count_of_scores[pathology] > 0:
-            aggregated_predictions[pathology] = total_score / count_of_scores[pathology]
-        else:
-            # If no valid scores for a pathology, you might want to assign a default (e.g., 0 or NaN)
-            aggregated_predictions[pathology] = 0.0 # or np.nan
-
-    return aggregated_predictions
-
-def chexpert_preds_to_text(predictions: Dict[str, float], threshold :int = 0.8) -> str:
-    """Converts CheXpert probability predictions to text findings based on a threshold."""
-    findings = []
-    for pathology, score in predictions.items():
-        if score >= threshold:
-            # Basic text conversion - could be more sophisticated
-            findings.append(f"{pathology.replace('_', ' ').lower()}")
-    if not findings:
-        return ""
-    return ", ".join(findings[:-1]) + "and" + findings[-1]
-
-def get_largest_image(image_paths: List[str]) -> Optional[str]:
-    """Finds the image with the largest file size among the given paths."""
-    largest_path = None
+    Returns an object PIL and skimage can read the image from.
+
+    Args:
+        image: A file path or an encoded image buffer (bytes, bytearray or memoryview).
+
+    Returns:
+        The path itself, or a file-like object over the buffer.
+    """
+    if is_image_path(image):
+        return image
+    return io.BytesIO(image)
+
+def get_image_size(image) -> int:
+    """Returns the size in bytes of an image path, buffer or array, or -1 if the image is missing."""
+    if image is None:
+        return -1
+    if hasattr(image, "encoded_size"):
+        return image.encoded_size
+    if is_image_path(image):
+        return os.path.getsize(image) if os.path.exists(image) else -1
+    if isinstance(image, np.ndarray):
+        return image.nbytes
+    return memoryview(image).nbytes
+
+def image_digest(image) -> Optional[str]:
+    """
+    Returns a content hash of an image, or None if the image is missing.
+
+    Paths and buffers are hashed over their encoded bytes, arrays over their pixels.
+    Images decoded by `imageLoader` carry their digest already.
+    """
+    if image is None:
+        return None
+    if hasattr(image, "digest"):
+        return image.digest
+
+    sha = hashlib.sha256()
+    if is_image_path(image):
+        if not os.path.exists(image):
+            return None
+        with open(image, "rb") as f:
+            for chunk in iter(lambda: f.read(1 << 20), b""):
+                sha.update(chunk)
+    elif isinstance(image, np.ndarray):
+        sha.update(f"{image.shape}{image.dtype}".encode("utf-8"))
+        sha.update(np.ascontiguousarray(image).data)
+    else:
+        sha.update(image)
+    return sha.hexdigest()
+
+def get_largest_image(images: List[ImageInput]) -> Optional[ImageInput]:
+    """Finds the largest image among the given paths, buffers or arrays."""
+    largest_image = None
     largest_size = -1
-    for path in image_paths:
-        if os.path.exists(path):
-            size = os.path.getsize(path)
-            if size > largest_size:
-                largest_size = size
-                largest_path = path
-    return largest_path
+    for image in images:
+        size = get_image_size(image)
+        if size > largest_size:
+            largest_size = size
+            largest_image = image
+    return largest_image
 
 def get_medical_studies(query_text: str, max_results: int = 5) -> List[Dict[str, str]]:
     """Fetches medical studies from PubMed based on a search query.
@@ -120,53 +157,4 @@ def get_medical_studies(query_text: str, max_results: int = 5) -> List[Dict[str,
     Returns:
         List[Dict[str, str]]: A list of dictionaries containing study details like title, authors, abstract, and link.
     """
-
-    # Step 1: Search PubMed for relevant article IDs
-    search_url = "https://eutils.ncbi.nlm.nih.gov/entrez/eutils/esearch.fcgi"
-    search_params = {
-        "db": "pubmed",
-        "term": query_text,
-        "retmode": "xml",
-        "retmax": max_results
-    }
-
-    search_resp = requests.get(search_url, params=search_params)
-    search_tree = ET.fromstring(search_resp.text)
-    ids = [id_elem.text for id_elem in search_tree.findall(".//Id")]
-
-    if not ids:
-        return []
-
-    # Step 2: Fetch article details
-    fetch_url = "https://eutils.ncbi.nlm.nih.gov/entrez/eutils/efetch.fcgi"
-    fetch_params = {
-        "db": "pubmed",
-        "id": ",".join(ids),
-        "retmode": "xml"
-    }
-
-    fetch_resp = requests.get(fetch_url, params=fetch_params)
-    fetch_tree = ET.fromstring(fetch_resp.text)
-
-    results = []
-    for article in fetch_tree.findall(".//PubmedArticle"):
-        title_elem = article.find(".//ArticleTitle")
-        abstract_elem = article.find(".//AbstractText")
-        authors = article.findall(".//Author")
-        author_names = []
-        for author in authors:
-            last = author.find("LastName")
-            fore = author.find("ForeName")
-            if last is not None and fore is not None:
-                author_names.append(f"{fore.text} {last.text}")
-        title = title_elem.text if title_elem is not None else "No title"
-        abstract = abstract_elem.text if abstract_elem is not None else "No abstract available"
-        pubmed_id = article.find(".//PMID").text
-        results.append({
-            "title": title,
-            "authors": author_names[:3],  # just top 3 authors
-            "abstract": abstract,
-            "link": f"https://pubmed.ncbi.nlm.nih.gov/{pubmed_id}/"
-        })
-
-    return results
\ No newline at end of file
+    return get_pubmed_client().get_medical_studies(query_text, max_results=max_results)
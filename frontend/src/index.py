@@ -3,9 +3,57 @@
 # Run the Streamlit app
 # To run the app, use the command: streamlit run index.py
 
+import hashlib
+import io
+import json
+import os
 import streamlit as st
 import requests
 import uuid
+from PIL import Image
+from requests.adapters import HTTPAdapter
+
+BACKEND_URL = os.getenv("BACKEND_URL", "http://127.0.0.1:8000")
+
+# The backend decodes JPEGs at a reduced scale keeping both sides at least 512 pixels and
+# its models take 224 (CheXpert) and 384 (BLIP) pixel inputs, so larger uploads are wasted
+UPLOAD_MIN_SIDE = 512
+UPLOAD_JPEG_QUALITY = 90
+
+# Completed responses kept per session, so going back to recent inputs needs no new request
+MAX_CACHED_RESPONSES = 8
+
+@st.cache_resource
+def get_session():
+    """HTTP session shared by every script run, keeping connections to the backend alive."""
+    session = requests.Session()
+    session.mount("http://", HTTPAdapter(pool_maxsize=10))
+    session.mount("https://", HTTPAdapter(pool_maxsize=10))
+    return session
+
+@st.cache_data(max_entries=32)
+def downscale_image(data):
+    """Shrinks an image so its shorter side is UPLOAD_MIN_SIDE pixels and re-encodes it as JPEG."""
+    img = Image.open(io.BytesIO(data))
+    if img.mode not in ("L", "RGB"):
+        img = img.convert("RGB")
+    scale = UPLOAD_MIN_SIDE / min(img.size)
+    if scale < 1:
+        img = img.resize((round(img.width * scale), round(img.height * scale)), Image.LANCZOS)
+    buffer = io.BytesIO()
+    img.save(buffer, format="JPEG", quality=UPLOAD_JPEG_QUALITY)
+    return buffer.getvalue()
+
+def stream_events(session, files, results):
+    """Yields the events of /get-prediction/stream as they arrive, recording the final result event in `results`."""
+    response = session.post(f"{BACKEND_URL}/get-prediction/stream", files=files, stream=True, timeout=(5, 60))
+    response.raise_for_status()
+    for line in response.iter_lines(decode_unicode=True):
+        if line:
+            event = json.loads(line)
+            if event["event"] == "result":
+                results.append(event)
+            yield event
 
 def main():
     st.set_page_config(page_title="ARGS", layout="wide")
@@ -52,9 +100,16 @@ def main():
 
     st.title("Automated Radiology Report Generation and Suggestion (ARGS)")
 
-    uid = str(uuid.uuid4())
+    # The uid stays the same across the reruns of a session
+    if "uid" not in st.session_state:
+        st.session_state.uid = str(uuid.uuid4())
+    uid = st.session_state.uid
     st.caption(f"Generated UID: `{uid}`")
 
+    # Final result events of the last completed responses, keyed by the request inputs,
+    # oldest first
+    responses = st.session_state.setdefault("responses", {})
+
     # Indications text box at the top
     indications = st.text_area("Indications", help="Provide relevant indications here.")
 
@@ -86,51 +141,126 @@ def main():
 
     st.markdown("---")
 
+    request_key = None
+    if frontal_image and lateral_image:
+        request_key = (
+            hashlib.sha256(frontal_image.getvalue()).hexdigest(),
+            hashlib.sha256(lateral_image.getvalue()).hexdigest(),
+            indications.strip(),
+            int(max_studies)
+        )
+
     if st.button("Submit"):
         if not (frontal_image and lateral_image and indications.strip()):
             st.error("Please upload both images and provide indications.")
+        elif request_key in responses:
+            responses[request_key] = responses.pop(request_key)
+            st.session_state.shown = request_key
         else:
-            # Reset file pointers
-            frontal_image.seek(0)
-            lateral_image.seek(0)
-
             files = {
                 "uid": (None, uid),
-                "frontalImage": (frontal_image.name, frontal_image, frontal_image.type),
-                "lateralImage": (lateral_image.name, lateral_image, lateral_image.type),
+                "frontalImage": ("frontal.jpg", downscale_image(frontal_image.getvalue()), "image/jpeg"),
+                "lateralImage": ("lateral.jpg", downscale_image(lateral_image.getvalue()), "image/jpeg"),
                 "indications": (None, indications),
                 "maxStudies": (None, str(max_studies))
             }
 
+            results = []
             try:
-                response = requests.post(
-                    "http://127.0.0.1:8000/get-prediction",
-                    files=files,
-                    timeout=30
-                )
-                response.raise_for_status()
-                data = response.json()
-                st.success("Prediction received!")
-
-                for item in data:
-                    st.markdown(f"### UID: `{item['uid']}`")
-                    st.markdown(f"**Findings:** {item['findings']}")
-                    st.markdown(f"**Impression:** {item['impression']}")
-                    
-                    if "medical_studies" in item and item["medical_studies"]:
-                        with st.expander("📚 Relevant Studies"):
-                            for study in item["medical_studies"]:
-                                st.markdown(f"""
-                                    <div class="studyBox">
-                                        <div class="studyTitle">{study['title']}</div>
-                                        <div class="studyAuthors">{"; ".join(study['authors'])}</div>
-                                        <div class="studyAbstract">{study['abstract'][:500]}{"..." if len(study['abstract']) > 500 else ""}</div>
-                                        <a href="{study['link']}" target="_blank">Read more</a>
-                                    </div>
-                                """, unsafe_allow_html=True)
-
+                # Partial results are streamed as NDJSON and rendered as they arrive
+                render_stream(stream_events(get_session(), files, results))
+                if results:
+                    responses[request_key] = results[-1]
+                    while len(responses) > MAX_CACHED_RESPONSES:
+                        del responses[next(iter(responses))]
+                    st.session_state.shown = request_key
             except Exception as e:
                 st.error(f"Error: {e}")
+            return
+
+    # Reruns (e.g. after expanding the studies) show the last response again without a new request
+    shown = st.session_state.get("shown")
+    if shown is not None and shown == request_key and shown in responses:
+        render_result(responses[shown])
+
+def render_studies(studies):
+    with st.expander("📚 Relevant Studies"):
+        for study in studies:
+            st.markdown(f"""
+                <div class="studyBox">
+                    <div class="studyTitle">{study['title']}</div>
+                    <div class="studyAuthors">{"; ".join(study['authors'])}</div>
+                    <div class="studyAbstract">{study['abstract'][:500]}{"..." if len(study['abstract']) > 500 else ""}</div>
+                    <a href="{study['link']}" target="_blank">Read more</a>
+                </div>
+            """, unsafe_allow_html=True)
+
+def render_result(event):
+    """Renders the final result event of a completed response."""
+    st.success("Prediction received!")
+    for item in event["results"]:
+        st.markdown(f"### UID: `{item['uid']}`")
+        st.markdown(f"**Findings:** {item['findings']}")
+        st.markdown(f"**Impression:** {item['impression']}")
+        if item.get("medical_studies"):
+            render_studies(item["medical_studies"])
+
+def render_stream(events):
+    """Renders the events of /get-prediction/stream progressively, replacing partial text as it grows."""
+    status = st.empty()
+    status.info("Analyzing images...")
+
+    st.markdown("#### Pathologies")
+    pathologies = st.empty()
+    col1, col2 = st.columns(2)
+    with col1:
+        st.markdown("#### Frontal Report")
+        frontal = st.empty()
+    with col2:
+        st.markdown("#### Lateral Report")
+        lateral = st.empty()
+    st.markdown("#### Summary")
+    findings = st.empty()
+    impression = st.empty()
+    studies = st.empty()
+
+    views = {"frontal": frontal, "lateral": lateral}
+    sections = {"findings": findings, "impression": impression}
+    text = {}
+
+    for event in events:
+        kind = event["event"]
+
+        if kind == "pathologies":
+            scores = {name: score for name, score in event["scores"].items() if score is not None}
+            top = sorted(scores.items(), key=lambda item: item[1], reverse=True)
+            pathologies.markdown(", ".join(f"{name}: {score:.2f}" for name, score in top))
+            status.info("Generating reports...")
+        elif kind == "report_token":
+            key = ("report", event["view"])
+            text[key] = text.get(key, "") + event["text"]
+            views[event["view"]].markdown(text[key])
+        elif kind == "report":
+            views[event["view"]].markdown(
+                f"**Findings:** {event['findings']}\n\n**Impression:** {event['impression']}"
+            )
+            status.info("Summarizing...")
+        elif kind == "summary_token":
+            key = ("summary", event["section"])
+            text[key] = text.get(key, "") + event["text"]
+            sections[event["section"]].markdown(f"**{event['section'].capitalize()}:** {text[key]}")
+        elif kind == "summary":
+            sections[event["section"]].markdown(f"**{event['section'].capitalize()}:** {event['text']}")
+        elif kind == "studies":
+            if event["medical_studies"]:
+                with studies.container():
+                    render_studies(event["medical_studies"])
+        elif kind == "result":
+            status.success("Prediction received!")
+            for item in event["results"]:
+                st.caption(f"UID: `{item['uid']}`")
+        elif kind == "error":
+            status.error(f"Error: {event['detail']}")
 
 if __name__ == "__main__":
     main()